@@ -34,15 +34,39 @@ hylt is copyleft 2005:
    john vernon.
 """
 
-import ConfigParser
+# Only what the viewer needs to put up its first screen is imported here;
+# the modules only the server, the exporter, the option parser and so on
+# need are slow to import and are imported where they're used.
+import array
+import bisect
+import collections
+import cStringIO
 import curses
 import curses.wrapper
-import optparse
+import errno
+import heapq
+import itertools
+import marshal
+import math
 import os.path
+import Queue
 import re
+import sre_constants
+import sre_parse
 import sys
+import threading
 import time
 
+# scandir lists directories without a stat() per entry; it's built into
+# newer Pythons and available separately for older ones.
+try:
+   from os import scandir
+except ImportError:
+   try:
+      from scandir import scandir
+   except ImportError:
+      scandir = None
+
 # SITE_CONFIG_FILE: The location of the overall site configuration file.  A
 # Hylt installer should put a default config here, stating any special help
 # file location, etc.
@@ -73,17 +97,263 @@ CONFIG_CONTROL_DICT = {
          "type": "environment",
          "variable": "EDITOR",
          "default": "vi"
+      },
+      "history_limit": {
+         "type": "integer",
+         "default": 10000
+      },
+      "collections": {
+         "type": "string",
+         "default": ""
+      }
+   }
+}
+
+# Configuration: The type of a complete configuration.  It is a named tuple
+# with a field for every section in CONFIG_CONTROL_DICT, each of which is a
+# named tuple of its own with a field for every option in that section, so
+# that options are read as config.pyui.editor and can't be changed.  See
+# generateConfiguration.
+
+CONFIG_SECTION_TYPES = dict ([(sect, collections.namedtuple (
+ sect.capitalize () + "Configuration", sorted (sect_dict.keys ())))
+ for sect, sect_dict in CONFIG_CONTROL_DICT.items ()])
+Configuration = collections.namedtuple ("Configuration",
+ sorted (CONFIG_CONTROL_DICT.keys ()))
+
+# CACHE_DIR: The directory, relative to the collection root, that indexes
+# and other caches of the collection are kept in.  CACHE_VERSION is bumped
+# whenever the format of any of them changes, which makes every existing
+# cache stale.  Caches are written with marshal, and only ever hold
+# PLAIN_TYPES: collections are shared, so anything in a cache may have been
+# put there by anyone who can write to the collection, and unlike pickle,
+# loading plain data can't run any code.
+
+CACHE_DIR = ".hylt-cache"
+CACHE_VERSION = 2
+PLAIN_TYPES = frozenset ([dict, list, tuple, set, frozenset, str, unicode,
+ int, long, float, bool, type (None)])
+
+# SESSION_DIR: The directory, in the user's home directory, that the viewer
+# keeps its sessions in; one for every collection viewed (see
+# sessionFilename), along with how often each page was visited.  They
+# aren't kept with the collection, as its other caches are, since everyone
+# viewing a shared collection has a session and visit counts of their own.
+
+SESSION_DIR = "~/.hylt-sessions"
+
+# TEXT_SEARCH_PREFIX: Starting a 'go to' search with this searches the
+# text of the pages instead of their filenames.
+
+TEXT_SEARCH_PREFIX = "="
+
+# REGEXP_SEARCH_PREFIX: Starting a 'go to' search with this matches the
+# regular expression against the names and text of the pages instead of
+# just their filenames.
+
+REGEXP_SEARCH_PREFIX = "~"
+
+# BACKLINK_SEARCH_PREFIX: Starting a 'go to' search with this finds the
+# pages that link to the page named by the rest of it.
+
+BACKLINK_SEARCH_PREFIX = "<"
+
+# SEARCH_POLL_DELAY: How often, in milliseconds, the viewer checks on a
+# search running in the background.
+
+SEARCH_POLL_DELAY = 50
+
+# WALK_THREADS: How many directories of a collection are listed at once
+# when walking the whole tree.
+
+WALK_THREADS = 8
+
+# PAGE_CACHE_LIMIT: Roughly how much memory, in bytes, the viewer keeps
+# parsed pages in, so that coming back to them doesn't mean reading them
+# again.  A parsed page takes about PAGE_CELL_SIZE bytes for every
+# character on it.
+
+PAGE_CACHE_LIMIT = 32 << 20
+PAGE_CELL_SIZE = 80
+
+# SESSION_MANIFEST_SIZE: How many of the most recently viewed pages a saved
+# session lists, to be read back into the page cache in the background
+# when the session is restored.
+
+SESSION_MANIFEST_SIZE = 32
+
+# PREFETCH_THREADS: How many pages the viewer reads ahead of time at once,
+# while waiting for a key (see Prefetcher).
+
+PREFETCH_THREADS = 2
+
+# READ_AHEAD_PAGES: How many pages of the forward history (usually the
+# results of a 'go to' search) are read ahead of time, so that stepping
+# through them is instant.
+
+READ_AHEAD_PAGES = 4
+
+# STARTUP_TARGET: How long, in milliseconds, the viewer should take from the
+# start of its process to putting up its first screen when started through
+# the hylt launcher, as measured by --benchmark-startup over STARTUP_RUNS
+# starts.  STARTUP_VARIABLE is the environment variable that tells a viewer
+# being benchmarked to report the time of its first screen and exit.
+
+STARTUP_TARGET = 30
+STARTUP_RUNS = 20
+STARTUP_VARIABLE = "HYLT_STARTUP_BENCHMARK"
+
+# READ_BENCHMARK_PAGES: How many of the collection's pages --benchmark-reads
+# reads and parses, stored each way a page can be, taking the best of
+# READ_BENCHMARK_RUNS runs.  It doesn't time the disk itself (the copies are
+# in the operating system's cache), so it also gives the time a disk
+# reading SLOW_DISK_BANDWIDTH bytes per second would add, which is what
+# compressing pages saves.
+
+READ_BENCHMARK_PAGES = 500
+READ_BENCHMARK_RUNS = 5
+SLOW_DISK_BANDWIDTH = 10 << 20
+
+# DEFAULT_OPTIONS: The value of every command line option that isn't given.
+# When none are given at all, as when the viewer is started from a shell
+# alias, optparse (which is slow to import) isn't needed.
+
+DEFAULT_OPTIONS = {
+   "export": False,
+   "watch": False,
+   "force": False,
+   "gzip": False,
+   "search_index": False,
+   "graph_json": None,
+   "graph_dot": None,
+   "check_links": False,
+   "serve": False,
+   "port": 8080,
+   "threads": 8,
+   "jobs": None,
+   "stats": False,
+   "benchmark_startup": False,
+   "benchmark_reads": False,
+   "interval": 1.0
+}
+
+# COMPRESSED_PAGE_SUFFIXES: A page can be stored compressed, as its name with
+# one of these added (Page.hylt.gz); it is still called Page.hylt everywhere
+# but on disk (see openPage).  If a page is stored more than one way, the
+# uncompressed copy wins, then the first of these.
+
+COMPRESSED_PAGE_SUFFIXES = (".gz", ".xz")
+
+# SEARCH_INDEX_DIR: The directory, relative to the collection root, that
+# the exporter writes the static search index and search page into.
+
+SEARCH_INDEX_DIR = "hylt-search"
+
+# TERM_REGEXP: What counts as a word when indexing pages for searching.
+
+TERM_REGEXP = re.compile ("[a-z0-9]+")
+
+# SEARCH_PAGE: The static page that searches an exported collection using
+# the index written by writeSearchIndex.  Every word typed has to appear
+# on a page for it to match.
+
+SEARCH_PAGE = """<?xml version="1.0" encoding="utf-8"?>
+<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.1//EN" "http://www.w3.org/TR/xhtml11/DTD/xhtml11.dtd">
+<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en">
+  <head>
+  <meta http-equiv="Content-Type" content="application/xhtml+xml; charset=utf-8" />
+    <title>Search</title>
+    <script type="text/javascript">
+//<![CDATA[
+var titles = null;
+var shards = {};
+
+function load (name, callback) {
+   var request = new XMLHttpRequest ();
+   request.onreadystatechange = function () {
+      if (4 == request.readyState) {
+         callback (request.status < 400 && request.responseText ?
+          JSON.parse (request.responseText) : null);
       }
+   };
+   request.open ("GET", name, true);
+   request.send (null);
+}
+
+function lookup (term, callback) {
+   var shard_char = term.charAt (0);
+   if (shard_char in shards) {
+      var shard = shards[shard_char];
+      var ids = [];
+      var page_id = 0;
+      var deltas = (shard && shard[term]) || [];
+      for (var i = 0; i < deltas.length; i++) {
+         page_id += deltas[i];
+         ids.push (page_id);
+      }
+      callback (ids);
+   } else {
+      load ("terms-" + shard_char + ".json", function (shard) {
+         shards[shard_char] = shard;
+         lookup (term, callback);
+      });
+   }
+}
+
+function search () {
+   var terms = document.getElementById ("query").value.toLowerCase ()
+    .match (/[a-z0-9]+/g) || [];
+   terms = terms.filter (function (term) { return term.length > 1; });
+   var matches = null;
+   var pending = terms.length;
+   var show = function () {
+      var results = document.getElementById ("results");
+      results.innerHTML = "";
+      (matches || []).forEach (function (page_id) {
+         var item = document.createElement ("li");
+         var link = document.createElement ("a");
+         link.href = "../" + encodeURI (titles[page_id][1]);
+         link.appendChild (document.createTextNode (titles[page_id][0]));
+         item.appendChild (link);
+         results.appendChild (item);
+      });
+   };
+   if (!pending) {
+      show ();
    }
+   terms.forEach (function (term) {
+      lookup (term, function (ids) {
+         matches = (null == matches) ? ids : matches.filter (
+          function (page_id) { return ids.indexOf (page_id) >= 0; });
+         if (0 == --pending) {
+            show ();
+         }
+      });
+   });
+   return false;
 }
 
+load ("titles.json", function (table) { titles = table; });
+//]]>
+    </script>
+  </head>
+  <body>
+    <div id="main">
+      <form action="" onsubmit="return search ();">
+        <input type="text" id="query" />
+        <input type="submit" value="Search" />
+      </form>
+      <ul id="results"></ul>
+    </div>
+  </body>
+</html>
+"""
+
 def generateTitle (filename):
    """Generates the title for a given Hylt page.  This typically entails
    stripping out any directories and converting underscores to spaces.
    """
    
-   to_return = ""
-
    # Get rid of anything before the last slash.
    basename = os.path.basename (filename)
 
@@ -91,13 +361,7 @@ def generateTitle (filename):
    primary_name = basename.split(".")[0]
 
    # Convert underscores to spaces.
-   for char in primary_name:
-      if "_" == char:
-         to_return += " "
-      else:
-         to_return += char
-
-   return to_return
+   return primary_name.replace ("_", " ")
 
 def exportToHTML (filename, data_array, link_list):
    """Exports a given filename to an XHTML document.  The document
@@ -105,6 +369,14 @@ def exportToHTML (filename, data_array, link_list):
    """
    
    file = open (filename, "w")
+   writeHTML (file, filename, data_array, link_list)
+   file.close ()
+
+def writeHTML (file, filename, data_array, link_list):
+   """Writes the XHTML version of a page to an open file (or anything
+   else with write and writelines methods).  FILENAME is only used to
+   generate the title.
+   """
 
    file.write ("<?xml version=\"1.0\" encoding=\"utf-8\"?>\n")
    file.write ("<!DOCTYPE html PUBLIC \"-//W3C//DTD XHTML 1.1//EN\" \"http://www.w3.org/TR/xhtml11/DTD/xhtml11.dtd\">\n")
@@ -151,36 +423,1747 @@ def exportToHTML (filename, data_array, link_list):
    file.write ("    </div>\n")
    file.write ("  </body>\n")
    file.write ("</html>\n")
-   file.close ()
 
+def parsePage (root, filename):
+   """Parses the page FILENAME (relative to the collection root ROOT)
+   outside of the viewer, returning the Page filled in by readHyltFile.
+   """
 
-def readHyltFile (filename, core_state):
-   """Given a particular filename, this function parses it and returns the
-   collection of values (in core_state) necessary for properly handling
-   the display and navigation of the page.
+   # The parser wants links relative to the page's own directory,
+   # exactly like it does when the viewer is sitting on the page.
+   page_state = Page (os.path.dirname (filename), generateTitle (filename))
+   readHyltFile (os.path.join (root, filename), page_state)
+   return page_state
+
+def renderHTML (filename, page_state):
+   """Returns the XHTML version of a page parsed by parsePage as a
+   string.
+   """
+
+   buffer = cStringIO.StringIO ()
+   writeHTML (buffer, filename, page_state.data_array,
+    page_state.link_list)
+   return buffer.getvalue ()
+
+def htmlFilename (filename):
+   """Returns the name of the XHTML file that a given Hylt page is
+   exported to; this is the same name with .hylt swapped for .html.
+   """
+
+   return filename[:-4] + "html"
+
+def exportWorker (job):
+   """Exports a single page of a collection.  This is the unit of work
+   handed to the export worker pool, so it takes a single tuple of
+   (collection root, page name relative to the root, force flag,
+   compress flag, index flag) and returns a tuple of (page name,
+   status, export statistics, search terms).  The status is one of
+   "exported", "unchanged" (the page was re-rendered, but came out the
+   same as before), "skipped" (the XHTML is already newer than the
+   page) or "error".
+
+   With the compress flag set, a gzipped copy of the XHTML is kept next
+   to it as well, for web servers that can hand those out directly.
+   The statistics are a tuple of (bytes compressed, compressed size,
+   seconds spent compressing), all zero if nothing was compressed.
+
+   With the index flag set, the page is parsed even if it is skipped,
+   and the search terms are the sorted list of the page's words as
+   given by extractTerms; otherwise they are None.
+   """
+
+   root, filename, force, compress, index = job
+   source = os.path.join (root, filename)
+   target = htmlFilename (source)
+   gz_target = target + ".gz"
+   no_stats = (0, 0, 0.0)
+   terms = None
+
+   try:
+      skip = False
+      if not force and os.path.isfile (target):
+         target_mtime = os.path.getmtime (target)
+         if (target_mtime >= pageMtime (source) and
+          (not compress or (os.path.isfile (gz_target) and
+          os.path.getmtime (gz_target) >= target_mtime))):
+            skip = True
+      if skip and not index:
+         return (filename, "skipped", no_stats, terms)
+
+      page_state = parsePage (root, filename)
+      if index:
+         terms = extractTerms (page_state.data_array, filename)
+      if skip:
+         return (filename, "skipped", no_stats, terms)
+
+      html = renderHTML (filename, page_state)
+
+      # Rewriting the files when nothing changed would just make every
+      # mirror downstream of us copy them again.  Their modification
+      # times do have to catch up with the page's, though, or the page
+      # would be rendered all over again by every export from now on.
+      status = "exported"
+      if os.path.isfile (target) and os.path.getsize (target) == len (html):
+         old_file = open (target, "r")
+         if old_file.read () == html:
+            status = "unchanged"
+         old_file.close ()
+      if "exported" == status:
+         html_file = open (target, "w")
+         html_file.write (html)
+         html_file.close ()
+      else:
+
+         # Rounded up to a whole second, which (unlike a fraction)
+         # comes back out of os.utime() exactly as it went in.
+         source_mtime = math.ceil (pageMtime (source))
+         for name in (target, gz_target):
+            if (os.path.isfile (name) and
+             os.path.getmtime (name) < source_mtime):
+               os.utime (name, (source_mtime, source_mtime))
+
+      if not compress:
+         return (filename, status, no_stats, terms)
+      if "unchanged" == status and os.path.isfile (gz_target):
+         return (filename, status, no_stats, terms)
+
+      import gzip
+      start_time = time.time ()
+      buffer = cStringIO.StringIO ()
+
+      # A fixed mtime in the gzip header keeps the output byte-for-byte
+      # reproducible.
+      gz_file = gzip.GzipFile (target, "wb", 9, buffer, 0)
+      gz_file.write (html)
+      gz_file.close ()
+      compressed = buffer.getvalue ()
+      elapsed = time.time () - start_time
+
+      gz_file = open (gz_target, "wb")
+      gz_file.write (compressed)
+      gz_file.close ()
+   except (IOError, OSError):
+
+      # The page probably vanished between finding it and reading it;
+      # a watcher will notice that on its next pass.
+      return (filename, "error", no_stats, None)
+
+   return (filename, status, (len (html), len (compressed), elapsed), terms)
+
+def createWorkerPool (jobs = None):
+   """Creates the worker pool used by the batch tools (the exporter,
+   the link graph, and so on), with one worker per CPU if JOBS is None.
+   A job count of one (or less) means "don't bother"; everything then
+   runs in this process, which is also handy when debugging.
+   """
+
+   if None != jobs and jobs <= 1:
+      return None
+
+   import multiprocessing
+   if None == jobs:
+      try:
+         jobs = multiprocessing.cpu_count ()
+      except NotImplementedError:
+         return None
+      if jobs <= 1:
+         return None
+   return multiprocessing.Pool (jobs)
+
+def mapJobs (worker, job_list, pool):
+   """Runs WORKER over every job in JOB_LIST, on POOL if there is one,
+   and returns the results.  With a pool, the results come back in
+   whatever order the workers finish in.
+   """
+
+   if None == pool:
+      return map (worker, job_list)
+   return pool.imap_unordered (worker, job_list, 16)
+
+def exportCollection (root, filenames = None, removed = (), force = False,
+ compress = False, page_terms = None, pool = None):
+   """Exports the pages of the collection at ROOT to XHTML.  If FILENAMES
+   is None, every page in the collection is considered; otherwise only
+   the given pages (relative to ROOT) are.  Pages whose XHTML is newer
+   than the page itself are skipped unless FORCE is set.  If COMPRESS
+   is set, .html.gz copies are kept up to date as well.  The XHTML
+   for every page in REMOVED is deleted.  Returns a dictionary of
+   statistics for the run.
+
+   If PAGE_TERMS is a dictionary, a search index for the exported site
+   is written as well (see writeSearchIndex).  The dictionary maps
+   pages to their search terms and is brought up to date with the
+   pages handled here, so a caller exporting a few pages at a time
+   (like the watcher) just keeps handing the same one back.
+   """
+
+   start_time = time.time ()
+   if None == filenames:
+      filenames = snapshotCollection (root).keys ()
+   filenames = sorted (filenames)
+
+   stats = {"exported": 0, "unchanged": 0, "skipped": 0, "error": 0,
+    "removed": 0, "gz_in": 0, "gz_out": 0, "gz_time": 0.0}
+
+   index = None != page_terms
+   job_list = [(root, filename, force, compress, index)
+    for filename in filenames]
+   for filename, status, gz_stats, terms in mapJobs (exportWorker, job_list,
+    pool):
+      stats[status] += 1
+      stats["gz_in"] += gz_stats[0]
+      stats["gz_out"] += gz_stats[1]
+      stats["gz_time"] += gz_stats[2]
+      if None != terms:
+         page_terms[filename] = terms
+
+   for filename in removed:
+      if index:
+         page_terms.pop (filename, None)
+      target = htmlFilename (os.path.join (root, filename))
+      if os.path.isfile (target):
+         try:
+            os.remove (target)
+            stats["removed"] += 1
+         except OSError:
+            stats["error"] += 1
+      if os.path.isfile (target + ".gz"):
+         try:
+            os.remove (target + ".gz")
+         except OSError:
+            stats["error"] += 1
+
+   if index:
+      index_start = time.time ()
+      stats["index_pages"] = len (page_terms)
+      stats["index_bytes"] = writeSearchIndex (root, page_terms)
+      stats["index_time"] = time.time () - index_start
+
+   stats["elapsed"] = time.time () - start_time
+   return stats
+
+def formatExportSummary (stats):
+   """Turns the statistics returned by exportCollection into a single
+   line suitable for printing.
+   """
+
+   summary = ("Exported %d pages, skipped %d unchanged, removed %d" %
+    (stats["exported"], stats["skipped"] + stats["unchanged"],
+    stats["removed"]))
+   if stats["error"]:
+      summary += ", %d errors" % (stats["error"])
+   summary += " (%.2fs)." % (stats["elapsed"])
+
+   # The compression figures are summed over the workers, so the
+   # throughput is per worker rather than for the whole pool.
+   if stats["gz_in"]:
+      summary += (" Compressed %d KiB to %d KiB (%.1f%%, %.1f MiB/s)." %
+       (stats["gz_in"] / 1024, stats["gz_out"] / 1024,
+       100.0 * stats["gz_out"] / stats["gz_in"],
+       stats["gz_in"] / (1048576.0 * max (stats["gz_time"], 1e-6))))
+   if "index_pages" in stats and stats["index_pages"]:
+      summary += (" Search index: %d pages, %d KiB in %.2fs"
+       " (%d KiB per 10k pages)." % (stats["index_pages"],
+       stats["index_bytes"] / 1024, stats["index_time"],
+       stats["index_bytes"] * 10000 / stats["index_pages"] / 1024))
+   return summary
+
+def extractTerms (data_array, filename):
+   """Returns the sorted list of distinct search terms on a parsed page:
+   every run of letters and digits in the page text and in its title,
+   lowercased.  Single characters are too common to be worth keeping.
+   """
+
+   return sorted (countTerms (data_array, filename).keys ())
+
+def pageLines (data_array):
+   """Returns the text of a parsed page as a list of lines, exactly as
+   it is displayed.
+   """
+
+   return ["".join ([char for char, link in row]) for row in data_array]
+
+def countTerms (data_array, filename):
+   """Returns a dictionary mapping every search term on a parsed page (as
+   described for extractTerms) to the number of times it appears.
+   """
+
+   counts = {}
+   text_list = [generateTitle (filename)] + pageLines (data_array)
+   for word in TERM_REGEXP.findall (" ".join (text_list).lower ()):
+      if len (word) > 1:
+         counts[word] = counts.get (word, 0) + 1
+   return counts
+
+def writeSearchIndex (root, page_terms):
+   """Writes a static search index for an exported collection into the
+   SEARCH_INDEX_DIR directory of ROOT, along with a search page that
+   uses it; returns the total size of the index in bytes.
+
+   Pages are numbered in filename order.  titles.json holds a list of
+   [title, XHTML file] pairs, one per page number.  The terms are split
+   into shards by their first character, terms-X.json; each shard maps
+   a term to the numbers of the pages containing it, delta-encoded
+   (every number after the first is the difference from the one before
+   it) to keep the files small.  A browser only ever needs the title
+   table plus one shard per search word.
+   """
+
+   index_dir = os.path.join (root, SEARCH_INDEX_DIR)
+   if not os.path.isdir (index_dir):
+      os.makedirs (index_dir)
+
+   page_list = sorted (page_terms.keys ())
+   titles = []
+   shards = {}
+   for page_id in range (len (page_list)):
+      filename = page_list[page_id]
+      titles.append ([generateTitle (filename),
+       htmlFilename (filename).replace (os.sep, "/")])
+      for term in page_terms[filename]:
+         shard = shards.setdefault (term[0], {})
+         shard.setdefault (term, []).append (page_id)
+
+   index_size = 0
+   written = {"titles.json": titles}
+   for shard_char, shard in shards.items ():
+      for term, id_list in shard.items ():
+         prev_id = 0
+         deltas = []
+         for page_id in id_list:
+            deltas.append (page_id - prev_id)
+            prev_id = page_id
+         shard[term] = deltas
+      written["terms-" + shard_char + ".json"] = shard
+
+   import json
+   for name, contents in written.items ():
+      data = json.dumps (contents, separators = (",", ":"),
+       sort_keys = True)
+      index_size += len (data)
+      index_file = open (os.path.join (index_dir, name), "w")
+      index_file.write (data)
+      index_file.close ()
+
+   # Shards for characters that no longer start any term are stale.
+   for name in os.listdir (index_dir):
+      if (name.startswith ("terms-") and name.endswith (".json") and
+       not name in written):
+         os.remove (os.path.join (index_dir, name))
+
+   search_file = open (os.path.join (index_dir, "search.html"), "w")
+   search_file.write (SEARCH_PAGE)
+   search_file.close ()
+
+   return index_size
+
+def snapshotCollection (root, poll_state = None):
+   """Returns a dictionary mapping every Hylt page in the collection at
+   ROOT (relative to ROOT) to its modification time.  If POLL_STATE is
+   given, it is kept from one snapshot to the next as per
+   iterPollCollection, so that only directories that have changed are
+   listed again.
+   """
+
+   snapshot = {}
+   if None == poll_state:
+      poll_state = {}
+   pollCollection (root, poll_state)
+   for dir_state in poll_state.values ():
+      snapshot.update (dir_state["files"])
+   return snapshot
+
+def pageStorage (filename):
+   """Returns the name of the file the page FILENAME is actually stored
+   in: FILENAME itself, or FILENAME with one of COMPRESSED_PAGE_SUFFIXES
+   added, or None if there is no such page.
+   """
+
+   for suffix in ("",) + COMPRESSED_PAGE_SUFFIXES:
+      if os.path.isfile (filename + suffix):
+         return filename + suffix
+   return None
+
+def pageMtime (filename):
+   """Returns the modification time of the page FILENAME, however it is
+   stored (see pageStorage).  An uncompressed page costs one stat(), as
+   it always did.  Raises OSError if there is no such page.
+   """
+
+   try:
+      return os.path.getmtime (filename)
+   except OSError:
+      for suffix in COMPRESSED_PAGE_SUFFIXES:
+         try:
+            return os.path.getmtime (filename + suffix)
+         except OSError:
+            pass
+      raise
+
+def importLzma ():
+   """Returns the lzma module, which .xz pages are read with, or None if
+   there is none.  It's built into newer Pythons and available
+   separately for older ones as backports.lzma; it's only imported once
+   an .xz page is read.
+   """
+
+   try:
+      import lzma
+   except ImportError:
+      try:
+         from backports import lzma
+      except ImportError:
+         lzma = None
+   return lzma
+
+def openPage (filename):
+   """Opens the page FILENAME for reading, however it is stored (see
+   pageStorage).  A compressed page is decompressed as it is read,
+   rather than all at once.  Raises IOError if there is no such page or
+   it can't be read.
+   """
+
+   try:
+      return open (filename, "r")
+   except IOError, error:
+      if errno.ENOENT != error.errno:
+         raise
+   if os.path.isfile (filename + ".gz"):
+      import gzip
+      return gzip.open (filename + ".gz", "rb")
+   if os.path.isfile (filename + ".xz"):
+      lzma = importLzma ()
+      if None == lzma:
+         raise IOError (errno.ENOSYS, "No lzma module to read the page with",
+          filename + ".xz")
+      return lzma.LZMAFile (filename + ".xz", "rb")
+   raise error
+
+def listCollectionDir (root, dir_name):
+   """Lists a single directory of the collection at ROOT, given relative
+   to ROOT.  Returns a tuple of (pages, subdirectories), both sorted
+   lists of names relative to ROOT; compressed pages are listed by the
+   name they'd have uncompressed (see COMPRESSED_PAGE_SUFFIXES).  Uses
+   scandir where it is available, as it can tell directories from files
+   without a stat() per entry.  Raises OSError if the directory can't
+   be listed.
+
+   Symbolic links to directories aren't subdirectories, just as they
+   weren't to os.walk: following them would walk the same pages over
+   and over (a link to ".." never ends), or walk out of the collection
+   altogether.  Links to pages are pages.
+   """
+
+   full_dir = os.path.join (root, dir_name) or "."
+   pages = set ()
+   subdirs = []
+   if None != scandir:
+      entries = [(entry.name, entry.is_dir (follow_symlinks = False))
+       for entry in scandir (full_dir)]
+   else:
+      entries = []
+      for entry in os.listdir (full_dir):
+         full_name = os.path.join (full_dir, entry)
+         entries.append ((entry, os.path.isdir (full_name) and
+          not os.path.islink (full_name)))
+   for entry, is_dir in entries:
+      if is_dir:
+         subdirs.append (os.path.join (dir_name, entry))
+         continue
+      for suffix in COMPRESSED_PAGE_SUFFIXES:
+         if entry.endswith (suffix):
+            entry = entry[:-len (suffix)]
+            break
+      if len (entry) > 5 and ".hylt" == entry[-5:]:
+         pages.add (os.path.join (dir_name, entry))
+   pages = sorted (pages)
+   subdirs.sort ()
+   return (pages, subdirs)
+
+def walkCollection (root, visit = None, sort = False, threads = WALK_THREADS):
+   """Walks the directory tree of the collection at ROOT, yielding one
+   result per directory as soon as it is available.  This is what
+   every collection-wide operation uses to find its pages.
+
+   VISIT is called with the name of every directory (relative to ROOT,
+   so "" for ROOT itself) and returns a tuple of (result, list of
+   subdirectories to walk into); directories with a result of None
+   aren't yielded.  By default it lists the directory, giving results
+   of (directory, pages, subdirectories) as per listCollectionDir.
+
+   Directories are visited by THREADS threads at once, since on network
+   filesystems nearly all of the time goes to waiting on the server.
+   VISIT has to be safe to call from several threads, then.  Results
+   come back in whatever order the directories finish in, unless SORT
+   is set: then they come back in the order a depth-first walk with
+   every directory's subdirectories sorted by name would give them.
+   Stopping early (closing the generator) stops the threads.
+   """
+
+   if None == visit:
+      def visit (dir_name):
+         try:
+            pages, subdirs = listCollectionDir (root, dir_name)
+         except OSError:
+            return (None, [])
+         return ((dir_name, pages, subdirs), subdirs)
+
+   if threads <= 1:
+      pending = [""]
+      while pending:
+         result, subdirs = visit (pending.pop ())
+         pending.extend (sorted (subdirs, reverse = True))
+         if None != result:
+            yield result
+      return
+
+   todo = Queue.Queue ()
+   done = Queue.Queue ()
+   stopped = []
+
+   def walkWorker ():
+      while True:
+         dir_name = todo.get ()
+         if None == dir_name:
+            return
+         result = (None, [])
+         if not stopped:
+            try:
+               result = visit (dir_name)
+            except:
+               pass
+         done.put ((dir_name, result))
+
+   worker_list = []
+   for i in range (threads):
+      worker = threading.Thread (target = walkWorker)
+      worker.setDaemon (True)
+      worker.start ()
+      worker_list.append (worker)
+
+   todo.put ("")
+   try:
+      if sort:
+
+         # Directories finish in any old order; hold on to the ones that
+         # finish early until it's their turn.
+         order = [""]
+         finished = {}
+         while order:
+            dir_name = order.pop ()
+            while not dir_name in finished:
+               done_name, done_result = done.get ()
+               finished[done_name] = done_result
+               for subdir in done_result[1]:
+                  todo.put (subdir)
+            result, subdirs = finished.pop (dir_name)
+            order.extend (sorted (subdirs, reverse = True))
+            if None != result:
+               yield result
+      else:
+         outstanding = 1
+         while outstanding:
+            dir_name, (result, subdirs) = done.get ()
+            outstanding -= 1
+            for subdir in subdirs:
+               todo.put (subdir)
+               outstanding += 1
+            if None != result:
+               yield result
+   finally:
+
+      # Any directories still queued are skipped; the workers only
+      # have to finish what they're in the middle of.
+      stopped.append (True)
+      for worker in worker_list:
+         todo.put (None)
+      for worker in worker_list:
+         worker.join ()
+
+def pollCollection (root, poll_state, stat_pages = True):
+   """Brings POLL_STATE up to date with the collection at ROOT and
+   returns a tuple of (changed, added, removed) page lists, all
+   relative to ROOT.  This is just iterPollCollection run to the end.
+   """
+
+   changes = ([], [], [])
+   for dir_name, dir_state in iterPollCollection (root, poll_state,
+    stat_pages, changes):
+      pass
+   return changes
+
+def iterPollCollection (root, poll_state, stat_pages = True, changes = None):
+   """Brings POLL_STATE up to date with the collection at ROOT, yielding
+   (directory, directory state) for every directory as it is brought
+   up to date.  POLL_STATE should start out as an empty dictionary and
+   be handed back unmodified on the next poll.  If CHANGES is given,
+   it is a tuple of three lists which the changed, added and removed
+   pages (all relative to ROOT) are appended to.  Removed directories
+   are only noticed once the whole tree has been polled; stopping
+   early is safe, but leaves them for the next poll to find.
+
+   Directories are only re-listed when their own modification time
+   changes, which is what happens when pages are created, deleted or
+   renamed; pages within them are simply stat()ed to catch edits.
+   If STAT_PAGES is False, even that is skipped: only the directories
+   are stat()ed, no page is ever reported as changed, and the page
+   modification times in POLL_STATE are all None.
+   """
+
+   def visit (dir_name):
+
+      # This runs in the walker's threads, so it only looks at
+      # POLL_STATE; all of the updating happens below.
+      full_dir = os.path.join (root, dir_name) or "."
+      try:
+         dir_mtime = os.path.getmtime (full_dir)
+      except OSError:
+         return (None, [])
+
+      dir_state = poll_state.get (dir_name)
+      if None == dir_state or dir_state["mtime"] != dir_mtime:
+         try:
+            names, subdirs = listCollectionDir (root, dir_name)
+         except OSError:
+            return (None, [])
+      else:
+         names = dir_state["names"]
+         subdirs = dir_state["subdirs"]
+
+      files = {}
+      for rel_name in names:
+         mtime = None
+         if stat_pages:
+            try:
+               mtime = pageMtime (os.path.join (root, rel_name))
+            except OSError:
+
+               # Gone already; the next relisting will take care of it.
+               continue
+         files[rel_name] = mtime
+      return ((dir_name, {"mtime": dir_mtime, "names": names,
+       "subdirs": subdirs, "files": files}), subdirs)
+
+   if None == changes:
+      changes = ([], [], [])
+   changed, added, removed = changes
+
+   seen_dirs = {}
+   for dir_name, dir_state in walkCollection (root, visit, True):
+      seen_dirs[dir_name] = True
+      if dir_name in poll_state:
+         old_files = poll_state[dir_name]["files"]
+      else:
+         old_files = {}
+      new_files = dir_state["files"]
+      for rel_name, mtime in new_files.items ():
+         if not rel_name in old_files:
+            added.append (rel_name)
+         elif old_files[rel_name] != mtime:
+            changed.append (rel_name)
+      for rel_name in old_files:
+         if not rel_name in new_files:
+            removed.append (rel_name)
+      poll_state[dir_name] = dir_state
+      yield (dir_name, dir_state)
+
+   # Any directory we didn't get to this time has been removed, along
+   # with all of its pages.
+   for dir_name in poll_state.keys ():
+      if not dir_name in seen_dirs:
+         removed.extend (poll_state[dir_name]["files"].keys ())
+         del poll_state[dir_name]
+
+def watchCollection (root, interval = 1.0, max_interval = 8.0, settle = 0.5,
+ compress = False, index = False, pool = None, report = None,
+ should_stop = None):
+   """Watches the collection at ROOT, re-exporting pages to XHTML as
+   they change.  The whole collection is brought up to date first.
+
+   The tree is polled every INTERVAL seconds; while nothing happens the
+   interval slowly backs off to MAX_INTERVAL so an idle watcher costs
+   next to nothing.  Once a change is seen, polling continues every
+   SETTLE seconds until a poll comes back clean, so that a burst of
+   saves gets exported as one batch.  COMPRESS is handed on to
+   exportCollection, and INDEX keeps a search index up to date.
+   REPORT, if given, is called with the statistics of every export;
+   SHOULD_STOP, if given, is called
+   once per poll and ends the watch when it returns True.
+   """
+
+   poll_state = {}
+   changed, added, removed = pollCollection (root, poll_state)
+   if index:
+      page_terms = {}
+   else:
+      page_terms = None
+   stats = exportCollection (root, added, compress = compress,
+    page_terms = page_terms, pool = pool)
+   if None != report:
+      report (stats)
+
+   curr_interval = interval
+   dirty = {}
+   gone = {}
+   while not (None != should_stop and should_stop ()):
+      if dirty or gone:
+         time.sleep (settle)
+      else:
+         time.sleep (curr_interval)
+
+      changed, added, removed = pollCollection (root, poll_state)
+      for filename in changed + added:
+         dirty[filename] = True
+         gone.pop (filename, None)
+      for filename in removed:
+         gone[filename] = True
+         dirty.pop (filename, None)
+
+      if changed or added or removed:
+
+         # Still settling; wait for a quiet poll before exporting.
+         curr_interval = interval
+      elif dirty or gone:
+         stats = exportCollection (root, dirty.keys (), gone.keys (),
+          force = True, compress = compress, page_terms = page_terms,
+          pool = pool)
+         if None != report:
+            report (stats)
+         dirty = {}
+         gone = {}
+      else:
+         curr_interval = min (curr_interval * 2, max_interval)
+
+
+class PageRequestHandler:
+   """Answers HTTP requests for the XHTML version of the pages in a
+   collection, as the exporter would have written them.  The
+   collection root and the rendered page cache live on the server.
+   This is mixed into BaseHTTPServer's request handler by
+   serveCollection.
+   """
+
+   server_version = "hylt/0.1.1"
+
+   def do_GET (self):
+      self.sendPage (True)
+
+   def do_HEAD (self):
+      self.sendPage (False)
+
+   def sendPage (self, send_body):
+      """Looks the requested page up, rendering it if the cached copy
+      is missing or stale, and sends it (or a 304 Not Modified if the
+      client's copy is still good).
+      """
+
+      import email.utils
+      import urllib
+      path = urllib.unquote (self.path.split ("?", 1)[0].split ("#", 1)[0])
+      path = path.lstrip ("/")
+      if "" == path or path.endswith ("/"):
+         path += "Start.html"
+
+      # Same rules as links in the viewer: no escaping the collection.
+      filename = safePath (os.path.normpath (path))
+      if (None == filename or len (filename) < 6 or
+       ".html" != filename[-5:]):
+         self.send_error (404)
+         return
+      filename = filename[:-4] + "hylt"
+
+      try:
+         cached = self.server.getPage (filename)
+      except (IOError, OSError):
+         self.send_error (404)
+         return
+      mtime, etag, html = cached
+
+      last_modified = self.date_time_string (int (mtime))
+      not_modified = False
+      if self.headers.getheader ("If-None-Match"):
+         not_modified = etag in [tag.strip () for tag in
+          self.headers.getheader ("If-None-Match").split (",")]
+      elif self.headers.getheader ("If-Modified-Since"):
+         since = email.utils.parsedate_tz (
+          self.headers.getheader ("If-Modified-Since"))
+         if None != since:
+            not_modified = int (mtime) <= email.utils.mktime_tz (since)
+
+      if not_modified:
+         self.send_response (304)
+         self.send_header ("ETag", etag)
+         self.send_header ("Last-Modified", last_modified)
+         self.end_headers ()
+         return
+
+      self.send_response (200)
+      self.send_header ("Content-Type", "application/xhtml+xml; charset=utf-8")
+      self.send_header ("Content-Length", str (len (html)))
+      self.send_header ("ETag", etag)
+      self.send_header ("Last-Modified", last_modified)
+      self.end_headers ()
+      if send_body:
+         self.wfile.write (html)
+
+   def log_request (self, code = "-", size = "-"):
+
+      # Successful requests aren't interesting enough to log one line
+      # each at hundreds of requests a second; errors still are.
+      pass
+
+class PageServer:
+   """An HTTP server for a collection.  Connections are handed to a
+   fixed pool of worker threads rather than a new thread each, and
+   rendered pages are kept in memory, keyed by filename and checked
+   against the page's modification time on every request.  The cache
+   holds at most cache_limit bytes of XHTML, dropping the least
+   recently used pages first.  Like PageRequestHandler, this is mixed
+   into BaseHTTPServer's server by serveCollection, with the handler
+   class to use as HANDLER.
+   """
+
+   allow_reuse_address = True
+
+   def __init__ (self, address, root, handler, threads = 8,
+    cache_limit = 64 << 20):
+      import BaseHTTPServer
+      BaseHTTPServer.HTTPServer.__init__ (self, address, handler)
+      self.root = root
+      self.cache_limit = cache_limit
+      self.cache_size = 0
+      self.page_cache = collections.OrderedDict ()
+      self.cache_lock = threading.Lock ()
+      self.requests = Queue.Queue (threads * 4)
+      for i in range (threads):
+         worker = threading.Thread (target = self.serveRequests)
+         worker.setDaemon (True)
+         worker.start ()
+
+   def process_request (self, request, client_address):
+      self.requests.put ((request, client_address))
+
+   def serveRequests (self):
+      """The body of every worker thread: handle requests forever.
+      """
+
+      while True:
+         request, client_address = self.requests.get ()
+         try:
+            self.finish_request (request, client_address)
+         except:
+            self.handle_error (request, client_address)
+         self.shutdown_request (request)
+
+   def getPage (self, filename):
+      """Returns (mtime, ETag, XHTML) for a page, rendering it only if
+      it isn't cached or has changed since it was.  Raises IOError or
+      OSError if the page doesn't exist.
+      """
+
+      source = pageStorage (os.path.join (self.root, filename))
+      if None == source:
+         raise IOError (errno.ENOENT, "No such page", filename)
+      stat = os.stat (source)
+      etag = "\"%x-%x\"" % (int (stat.st_mtime * 1000), stat.st_size)
+
+      self.cache_lock.acquire ()
+      try:
+         cached = self.page_cache.pop (filename, None)
+         if None != cached:
+            if cached[1] == etag:
+               self.page_cache[filename] = cached
+               return cached
+            self.cache_size -= len (cached[2])
+      finally:
+         self.cache_lock.release ()
+
+      # Render outside of the lock; two threads may race to render the
+      # same page, which costs a little time but no correctness.
+      cached = (stat.st_mtime, etag,
+       renderHTML (filename, parsePage (self.root, filename)))
+
+      self.cache_lock.acquire ()
+      try:
+         old = self.page_cache.pop (filename, None)
+         if None != old:
+            self.cache_size -= len (old[2])
+         self.page_cache[filename] = cached
+         self.cache_size += len (cached[2])
+         while self.cache_size > self.cache_limit and len (self.page_cache) > 1:
+            old_name, old = self.page_cache.popitem (False)
+            self.cache_size -= len (old[2])
+      finally:
+         self.cache_lock.release ()
+
+      return cached
+
+def serveCollection (root, port = 8080, threads = 8):
+   """Serves the collection at ROOT over HTTP on localhost until
+   interrupted.
+   """
+
+   # BaseHTTPServer is slow to import, and only the server needs it, so
+   # the server classes are only put together here.
+   import BaseHTTPServer
+   class Handler (PageRequestHandler, BaseHTTPServer.BaseHTTPRequestHandler):
+      pass
+   class Server (PageServer, BaseHTTPServer.HTTPServer):
+      pass
+
+   server = Server (("127.0.0.1", port), root, Handler, threads)
+   print "Serving %s at http://127.0.0.1:%d/" % (root or ".", port)
+   sys.stdout.flush ()
+   try:
+      server.serve_forever ()
+   finally:
+      server.server_close ()
+
+def linkWorker (job):
+   """Parses a single page for the link graph.  Takes a tuple of
+   (collection root, page name relative to the root) and returns a
+   tuple of (page name, link list), where the link list is exactly
+   what readHyltFile produces, or None if the page couldn't be read.
+   """
+
+   root, filename = job
+   try:
+      return (filename, parsePage (root, filename).link_list)
+   except (IOError, OSError):
+      return (filename, None)
+
+def buildLinkGraph (root, pool = None):
+   """Parses every page of the collection at ROOT and returns its link
+   graph: a dictionary mapping every readable page (relative to ROOT)
+   to a list of its links, in page order.  Every link is a tuple of
+   (link as written, resolved page name, missing flag); the missing
+   flag is True if the resolved page doesn't exist.
+   """
+
+   pages = snapshotCollection (root)
+   job_list = [(root, filename) for filename in sorted (pages.keys ())]
+
+   graph = {}
+   for filename, link_list in mapJobs (linkWorker, job_list, pool):
+      if None == link_list:
+         continue
+      base_path = os.path.dirname (filename)
+      links = []
+      for raw_link in link_list:
+         resolved = os.path.normpath (os.path.join (base_path, raw_link))
+         links.append ((raw_link, resolved, not resolved in pages))
+      graph[filename] = links
+   return graph
+
+def writeLinkGraphJSON (file, graph):
+   """Writes a link graph from buildLinkGraph to FILE as JSON: an object
+   mapping every page to its title and its list of links, each of which
+   has the link as written ("link"), the page it resolves to
+   ("target") and whether that page is missing ("missing").
+   """
+
+   import json
+   pages = {}
+   for filename, links in graph.items ():
+      pages[filename] = {
+         "title": generateTitle (filename),
+         "links": [{"link": raw_link, "target": resolved,
+          "missing": missing} for raw_link, resolved, missing in links]
+      }
+   json.dump ({"pages": pages}, file, indent = 1, sort_keys = True)
+   file.write ("\n")
+
+def writeLinkGraphDOT (file, graph):
+   """Writes a link graph from buildLinkGraph to FILE in Graphviz DOT
+   format.  Pages are labelled with their titles; missing pages are
+   drawn dashed and red, as are the links to them.  A page linking to
+   the same target more than once gets a single edge.
+   """
+
+   def quote (text):
+      return "\"" + text.replace ("\\", "\\\\").replace ("\"", "\\\"") + "\""
+
+   file.write ("digraph hylt {\n")
+   file.write ("   node [shape=box];\n")
+   missing_pages = {}
+   for filename in sorted (graph.keys ()):
+      file.write ("   %s [label=%s];\n" % (quote (filename),
+       quote (generateTitle (filename))))
+   for filename in sorted (graph.keys ()):
+      seen = {}
+      for raw_link, resolved, missing in graph[filename]:
+         if resolved in seen:
+            continue
+         seen[resolved] = True
+         if missing:
+            missing_pages[resolved] = True
+            file.write ("   %s -> %s [style=dashed, color=red];\n" %
+             (quote (filename), quote (resolved)))
+         else:
+            file.write ("   %s -> %s;\n" % (quote (filename),
+             quote (resolved)))
+   for resolved in sorted (missing_pages.keys ()):
+      file.write ("   %s [label=%s, style=dashed, color=red];\n" %
+       (quote (resolved), quote (generateTitle (resolved))))
+   file.write ("}\n")
+
+def checkWorker (job):
+   """Parses a single page for checkCollectionLinks.  Takes a tuple of
+   (collection root, page name relative to the root) and returns a
+   tuple of (page name, links, escaped links), where every link is a
+   tuple of (link as written, line, column) and the escaped links are
+   exactly what readHyltFile records; both are None if the page
+   couldn't be read.
+   """
+
+   root, filename = job
+   try:
+      page_state = parsePage (root, filename)
+   except (IOError, OSError):
+      return (filename, None, None)
+   links = [(raw_link,) + position for raw_link, position in
+    zip (page_state.link_list, page_state.link_positions)]
+   return (filename, links, page_state.escaped_links)
+
+def checkCollectionLinks (root, start = "Start.hylt", pool = None):
+   """Parses every page of the collection at ROOT, on POOL if there is
+   one, and checks every link on them, resolving links exactly as the
+   viewer does.  Returns a dictionary with:
+   - "pages", "links": how many pages and (valid) links were checked;
+   - "broken": every link to a page that doesn't exist, as (page, line,
+     column, link as written, resolved page name);
+   - "escaped": every link that tries to escape the collection, as
+     (page, line, column, link as written);
+   - "unreadable": every page that couldn't be read;
+   - "orphans": every page that can't be reached from START by
+     following links.
+   Pages are named relative to ROOT, and everything is sorted.
+   """
+
+   pages = snapshotCollection (root)
+   job_list = [(root, filename) for filename in sorted (pages.keys ())]
+
+   report = {"pages": 0, "links": 0, "broken": [], "escaped": [],
+    "unreadable": []}
+   graph = {}
+   for filename, links, escaped_links in mapJobs (checkWorker, job_list,
+    pool):
+      if None == links:
+         report["unreadable"].append (filename)
+         continue
+      base_path = os.path.dirname (filename)
+      targets = set ()
+      for raw_link, line, column in links:
+         resolved = os.path.normpath (os.path.join (base_path, raw_link))
+         if resolved in pages:
+            targets.add (resolved)
+         else:
+            report["broken"].append ((filename, line, column, raw_link,
+             resolved))
+      for raw_link, line, column in escaped_links:
+         report["escaped"].append ((filename, line, column, raw_link))
+      graph[filename] = targets
+      report["pages"] += 1
+      report["links"] += len (links)
+
+   # Everything reachable from the start page isn't an orphan.
+   reachable = set ()
+   if start in graph:
+      reachable.add (start)
+      pending = [start]
+      while pending:
+         for target in graph[pending.pop ()]:
+            if target in graph and not target in reachable:
+               reachable.add (target)
+               pending.append (target)
+   report["orphans"] = sorted ([filename for filename in graph
+    if not filename in reachable])
+
+   for key in ("broken", "escaped", "unreadable"):
+      report[key].sort ()
+   return report
+
+def writeLinkReport (file, report):
+   """Writes a report from checkCollectionLinks to FILE, one problem per
+   line, in the "file:line:column: message" form that editors know how
+   to jump to, followed by a summary.  Returns the number of problems.
+   """
+
+   for filename, line, column, raw_link, resolved in report["broken"]:
+      file.write ("%s:%d:%d: broken link to %s (%s does not exist)\n" %
+       (filename, line, column, raw_link[:-5], resolved))
+   for filename, line, column, raw_link in report["escaped"]:
+      file.write ("%s:%d:%d: link to %s escapes the collection\n" %
+       (filename, line, column, raw_link[:-5]))
+   for filename in report["unreadable"]:
+      file.write ("%s: could not be read\n" % (filename))
+   for filename in report["orphans"]:
+      file.write ("%s: not linked to from the start page\n" % (filename))
+
+   problems = (len (report["broken"]) + len (report["escaped"]) +
+    len (report["unreadable"]) + len (report["orphans"]))
+   file.write ("Checked %d pages and %d links: %d broken, %d escaping, "
+    "%d unreadable, %d orphaned.\n" % (report["pages"], report["links"],
+    len (report["broken"]), len (report["escaped"]),
+    len (report["unreadable"]), len (report["orphans"])))
+   return problems
+
+class Location (object):
+   """A place in the history: a page, and where the viewer was on it.
+   (cx, cy) is the top left corner of the view, and selected_link is
+   the number of the selected link, or None if the page has no links.
+   """
+
+   __slots__ = ("filename", "cx", "cy", "selected_link")
+
+   def __init__ (self, filename, cx = 0, cy = 0, selected_link = 0):
+      self.filename = filename
+      self.cx = cx
+      self.cy = cy
+      self.selected_link = selected_link
+
+class History (object):
+   """The viewer's history: a list of Locations, at most limit long, kept
+   compactly.  The filenames are interned, so that a page that shows up
+   in the history many times is only stored once, and the positions on
+   the pages are packed three to an entry into a single array, with a
+   selected_link of None stored as -1.  Entries are only turned into
+   Locations when they are asked for (see get and put).
+
+   The entries live in a ring: when the history is full, adding an
+   entry overwrites the oldest one.  Cutting the history short only
+   changes its length; the entries past the end are overwritten as new
+   ones are added.
+   """
+
+   __slots__ = ("limit", "filenames", "positions", "start", "length")
+
+   def __init__ (self, limit = CONFIG_CONTROL_DICT["pyui"]["history_limit"]
+    ["default"]):
+      self.limit = max (2, limit)
+      self.filenames = []
+      self.positions = array.array ("i")
+      self.start = 0
+      self.length = 0
+
+   def __len__ (self):
+      return self.length
+
+   def slot (self, index):
+      return (self.start + index) % self.limit
+
+   def get (self, index):
+      slot = self.slot (index)
+      cx, cy, selected_link = self.positions[slot * 3:slot * 3 + 3]
+      if -1 == selected_link:
+         selected_link = None
+      return Location (self.filenames[slot], cx, cy, selected_link)
+
+   def put (self, index, location):
+      slot = self.slot (index)
+      selected_link = location.selected_link
+      if None == selected_link:
+         selected_link = -1
+      self.filenames[slot] = intern (location.filename)
+      self.positions[slot * 3:slot * 3 + 3] = array.array ("i",
+       [location.cx, location.cy, selected_link])
+
+   def append (self, location):
+      """Adds LOCATION to the end of the history, returning True if the
+      oldest entry had to be dropped to make room for it.
+      """
+
+      dropped = self.length == self.limit
+      if dropped:
+         self.start = self.slot (1)
+         self.length -= 1
+      slot = self.slot (self.length)
+      if slot == len (self.filenames):
+         self.filenames.append (None)
+         self.positions.extend ([0, 0, 0])
+      self.length += 1
+      self.put (self.length - 1, location)
+      return dropped
+
+   def truncate (self, length):
+      self.length = min (self.length, length)
+
+   def remove (self, index):
+      """Drops the entry at INDEX; the entries after it each move back
+      one.
+      """
+
+      for later in range (index, self.length - 1):
+         self.put (later, self.get (later + 1))
+      self.length -= 1
+
+   def pack (self):
+      """Returns the history as a list of filenames and a string of their
+      packed positions, oldest first, for saving (see unpack).
+      """
+
+      start = self.start
+      filenames = self.filenames[start:] + self.filenames[:start]
+      positions = self.positions[start * 3:] + self.positions[:start * 3]
+      return (filenames[:self.length], positions[:self.length * 3].tostring ())
+
+   def unpack (self, filenames, positions):
+      """Replaces the history with one saved by pack, keeping only the
+      newest entries if there are more of them than the limit allows.
+      Returns the number of entries dropped.
+      """
+
+      packed = array.array ("i")
+      packed.fromstring (positions)
+      if len (packed) != len (filenames) * 3:
+         raise ValueError ("history positions don't match its filenames")
+      dropped = max (0, len (filenames) - self.limit)
+      self.filenames = map (intern, filenames[dropped:])
+      self.positions = packed[dropped * 3:]
+      self.start = 0
+      self.length = len (self.filenames)
+      return dropped
+
+class PageCache (object):
+   """The parsed pages the viewer has read lately, keyed by the root of
+   their collection joined with their names relative to it (so that the
+   collections of a Workspace can share one cache) and checked against
+   the page's modification time whenever they are asked for.  The cache holds
+   roughly limit bytes of pages (see PAGE_CELL_SIZE), dropping the least
+   recently used ones first.  It can be shared between threads.
+   """
+
+   __slots__ = ("limit", "size", "pages", "lock")
+
+   def __init__ (self, limit = PAGE_CACHE_LIMIT):
+      self.limit = limit
+      self.size = 0
+      self.pages = collections.OrderedDict ()
+      self.lock = threading.Lock ()
+
+   def get (self, filename, mtime):
+      """Returns the cached Page for FILENAME, or None if it isn't cached
+      or was cached before the page was last changed (at MTIME).
+      """
+
+      self.lock.acquire ()
+      try:
+         cached = self.pages.pop (filename, None)
+         if None == cached:
+            return None
+         if cached[0] != mtime:
+            self.size -= cached[1]
+            return None
+         self.pages[filename] = cached
+         return cached[2]
+      finally:
+         self.lock.release ()
+
+   def put (self, filename, mtime, page):
+      """Caches PAGE as FILENAME, as of MTIME, and returns roughly how much
+      memory it takes.
+      """
+
+      size = sum (map (len, page.data_array)) * PAGE_CELL_SIZE
+      self.lock.acquire ()
+      try:
+         old = self.pages.pop (filename, None)
+         if None != old:
+            self.size -= old[1]
+         self.pages[filename] = (mtime, size, page)
+         self.size += size
+         while self.size > self.limit and len (self.pages) > 1:
+            old_name, old = self.pages.popitem (False)
+            self.size -= old[1]
+      finally:
+         self.lock.release ()
+      return size
+
+   def __contains__ (self, filename):
+      self.lock.acquire ()
+      try:
+         return filename in self.pages
+      finally:
+         self.lock.release ()
+
+   def discard (self, filename):
+      self.lock.acquire ()
+      try:
+         old = self.pages.pop (filename, None)
+         if None != old:
+            self.size -= old[1]
+      finally:
+         self.lock.release ()
+
+   def names (self, root):
+      """Returns the names of the cached pages of the collection at ROOT,
+      relative to ROOT, most recently used first.
+      """
+
+      prefix = os.path.join (root, "")
+      self.lock.acquire ()
+      try:
+         names = [name[len (prefix):] for name in self.pages.keys ()
+          if name.startswith (prefix)]
+      finally:
+         self.lock.release ()
+      names.reverse ()
+      return names
+
+class Prefetcher (object):
+   """Reads pages of the collection at root into a PageCache in the
+   background, ahead of the viewer asking for them, on a fixed number
+   of threads.  Every call to
+   prefetch cancels whatever the last one asked for that hasn't been
+   started yet.  The pages read for one call that haven't been gone to
+   yet may only fill half of the cache; anything it asks for beyond
+   that is skipped.  Pages read for earlier calls are left to the cache
+   to drop like any others.  The stats dictionary counts:
+   - "requested": pages asked for;
+   - "read": pages actually read into the cache;
+   - "cancelled": pages that were dropped before they were started;
+   - "skipped": pages that were dropped because the cache was full;
+   - "hits": pages the viewer went to after they were read for it;
+   - "wasted": pages read that the viewer never went to (counted as
+     the cache drops them, and once the prefetcher is stopped).
+   """
+
+   def __init__ (self, page_cache, root, threads = PREFETCH_THREADS):
+      self.page_cache = page_cache
+      self.root = root
+      self.jobs = Queue.Queue ()
+      self.generation = 0
+      self.lock = threading.Lock ()
+      self.unused = {}
+      self.unused_size = 0
+      self.stats = {"requested": 0, "read": 0, "cancelled": 0, "skipped": 0,
+       "hits": 0, "wasted": 0}
+      self.threads = []
+      for i in range (threads):
+         worker = threading.Thread (target = self.prefetchPages)
+         worker.setDaemon (True)
+         worker.start ()
+         self.threads.append (worker)
+
+   def prefetch (self, filenames):
+      """Cancels the pages asked for last time, and starts reading the
+      pages FILENAMES (relative to the collection root), in order.
+      """
+
+      self.lock.acquire ()
+      try:
+         self.generation += 1
+         self.unused_size = 0
+
+         # Forget the pages the cache has dropped since, so that only
+         # pages that can still be gone to are waiting for the viewer.
+         for filename in self.unused.keys ():
+            if os.path.join (self.root, filename) not in self.page_cache:
+               del self.unused[filename]
+               self.stats["wasted"] += 1
+         for filename in filenames:
+            self.jobs.put ((self.generation, os.path.normpath (filename)))
+         self.stats["requested"] += len (filenames)
+      finally:
+         self.lock.release ()
+
+   def cancel (self):
+      self.prefetch ([])
+
+   def prefetchPages (self):
+      """The body of every worker thread: read pages until told to stop
+      by a job of None.
+      """
+
+      while True:
+         job = self.jobs.get ()
+         if None == job:
+            return
+         generation, filename = job
+         if generation != self.generation:
+            self.count ("cancelled")
+            continue
+         full_name = os.path.join (self.root, filename)
+         try:
+            mtime = pageMtime (full_name)
+            if None != self.page_cache.get (full_name, mtime):
+               continue
+            if self.unused_size > self.page_cache.limit / 2:
+               self.count ("skipped")
+               continue
+            page = Page (os.path.dirname (filename), generateTitle (filename))
+            readHyltFile (full_name, page)
+         except (IOError, OSError):
+            continue
+         size = self.page_cache.put (full_name, mtime, page)
+         self.lock.acquire ()
+         try:
+            old = self.unused.get (filename)
+            if None != old and old[1] == self.generation:
+               self.unused_size -= old[0]
+            if generation == self.generation:
+               self.unused_size += size
+            self.unused[filename] = (size, generation)
+            self.stats["read"] += 1
+         finally:
+            self.lock.release ()
+
+   def count (self, stat):
+      self.lock.acquire ()
+      try:
+         self.stats[stat] += 1
+      finally:
+         self.lock.release ()
+
+   def noteLoad (self, filename):
+      """Tells the prefetcher that the viewer went to a page, so that it
+      can tell whether reading the page ahead of time paid off.
+      """
+
+      self.lock.acquire ()
+      try:
+         if filename in self.unused:
+            size, generation = self.unused.pop (filename)
+            if generation == self.generation:
+               self.unused_size -= size
+            self.stats["hits"] += 1
+      finally:
+         self.lock.release ()
+
+   def stop (self):
+      """Stops the worker threads, dropping anything they haven't started
+      on, and returns the final stats.
+      """
+
+      self.cancel ()
+      for worker in self.threads:
+         self.jobs.put (None)
+      for worker in self.threads:
+         worker.join ()
+      self.stats["wasted"] += len (self.unused)
+      return self.stats
+
+class DirectoryCache (object):
+   """The pages in every directory that the viewer has looked in, so
+   that whether a page exists can be answered without a stat() of its
+   own.  Directories are kept by the root of their collection and their
+   name relative to it, so the collections of a Workspace can share one
+   cache.  A directory's listing is kept until the directory's
+   modification time changes, which it does whenever a page is added to
+   or removed from it; checking that costs one stat() of the directory,
+   however many pages in it are asked about.
+   """
+
+   __slots__ = ("dirs",)
+
+   def __init__ (self):
+      self.dirs = {}
+
+   def pages (self, root, dir_name):
+      """Returns the set of pages in DIR_NAME of the collection at ROOT
+      (relative to ROOT, like the names of the pages themselves), or an
+      empty set if it isn't a directory.
+      """
+
+      key = (root, dir_name)
+      try:
+         mtime = os.path.getmtime (os.path.join (root, dir_name) or ".")
+         cached = self.dirs.get (key)
+         if None != cached and cached[0] == mtime:
+            return cached[1]
+         pages = frozenset (listCollectionDir (root, dir_name)[0])
+      except OSError:
+         self.dirs.pop (key, None)
+         return frozenset ()
+      self.dirs[key] = (mtime, pages)
+      return pages
+
+   def exists (self, root, filename):
+      filename = os.path.normpath (filename)
+      return filename in self.pages (root, os.path.dirname (filename))
+
+class Page (object):
+   """A parsed Hylt page.  Everything but the base path (the directory
+   links on the page are relative to) and the title is filled in by
+   readHyltFile: the data array of (character, link number) cells, the
+   link list and where the links are (see readHyltFile), and the
+   width (mx) and height (my) of the page.
+   """
+
+   __slots__ = ("curr_base_path", "title", "data_array", "link_list",
+    "link_positions", "escaped_links", "link_count", "mx", "my")
+
+   def __init__ (self, curr_base_path = "", title = ""):
+      self.curr_base_path = curr_base_path
+      self.title = title
+      self.data_array = []
+      self.link_list = []
+      self.link_positions = []
+      self.escaped_links = []
+      self.link_count = 0
+      self.mx = 0
+      self.my = 0
+
+class Viewer (object):
+   """Everything the viewer knows about one collection: the size of the
+   screen (y, x), the configuration, the collection's root directory
+   (every page name is relative to it, never to the current directory),
+   the page being shown and the PageCache it came from (and the
+   Prefetcher filling it, if there is one), the History and where in it
+   the viewer is, the Location last counted as a visit, the
+   DirectoryCache that says which links lead to pages that exist (the
+   caches may be shared with other viewers; see Workspace), and the
+   indexes and searches of the collection, which are loaded as they are
+   needed (along with the pollCollection state they are all brought up
+   to date with).  None of it needs curses, so batch tools can use a Viewer
+   (with loadPage and the history functions) to walk a collection
+   exactly the way the viewer would.
+   """
+
+   __slots__ = ("y", "x", "config", "root", "page", "history",
+    "history_position", "location", "visited", "page_cache", "warmer",
+    "prefetcher", "dir_cache", "filename_index", "text_index",
+    "poll_state", "trigram_index", "backlink_index", "search",
+    "title_table", "visits", "page_search")
+
+   def __init__ (self, y = 24, x = 80, config = None, root = ".",
+    page_cache = None, dir_cache = None):
+      self.y = y
+      self.x = x
+      self.config = config
+      self.root = root
+      self.page = None
+      self.history = History ()
+      self.history_position = 0
+      self.location = None
+      self.visited = None
+      if None == page_cache:
+         page_cache = PageCache ()
+      if None == dir_cache:
+         dir_cache = DirectoryCache ()
+      self.page_cache = page_cache
+      self.warmer = None
+      self.prefetcher = None
+      self.dir_cache = dir_cache
+      self.filename_index = None
+      self.text_index = None
+      self.poll_state = {}
+      self.trigram_index = None
+      self.backlink_index = None
+      self.search = None
+      self.title_table = None
+      self.visits = None
+      self.page_search = None
+
+   def currentLocation (self):
+      """Returns the Location the viewer is at.  Changes to it are kept
+      until the viewer moves elsewhere in the history, when they are
+      stored back in the history.
+      """
+
+      if None == self.location:
+         self.location = self.history.get (self.history_position)
+      return self.location
+
+def readPage (filename, page_cache, root = "."):
+   """Returns the parsed Page FILENAME (relative to the collection root
+   ROOT), from PAGE_CACHE if it is there and the page hasn't changed
+   since, and otherwise by reading it and caching it.  Raises IOError
+   or OSError if the page can't be read.
+   """
+
+   filename = os.path.normpath (filename)
+   full_name = os.path.join (root, filename)
+   mtime = pageMtime (full_name)
+   page = page_cache.get (full_name, mtime)
+   if None == page:
+      page = Page (os.path.dirname (filename), generateTitle (filename))
+      readHyltFile (full_name, page)
+      page_cache.put (full_name, mtime, page)
+   return page
+
+def loadPage (core_state, filename):
+   """Reads the page FILENAME (relative to the viewer's collection root)
+   and makes it the viewer's current page.
+   """
+
+   core_state.page = readPage (filename, core_state.page_cache,
+    core_state.root)
+   if None != core_state.prefetcher:
+      core_state.prefetcher.noteLoad (os.path.normpath (filename))
+
+def selectedLinkTarget (core_state):
+   """Returns the page the selected link on the current page leads to,
+   relative to the collection root, or None if no link is selected.
+   """
+
+   selected_link = core_state.currentLocation ().selected_link
+   if None == selected_link:
+      return None
+   return os.path.normpath (os.path.join (core_state.page.curr_base_path,
+    core_state.page.link_list[selected_link]))
+
+def missingLinks (core_state):
+   """Returns the set of the numbers of the links on the current page
+   that lead to pages that don't exist.  This takes one stat() for every
+   directory the links lead into, rather than one for every link.
+   """
+
+   page = core_state.page
+   listings = {}
+   missing = set ()
+   for link_num in range (len (page.link_list)):
+      target = os.path.normpath (os.path.join (page.curr_base_path,
+       page.link_list[link_num]))
+      dir_name = os.path.dirname (target)
+      if not dir_name in listings:
+         listings[dir_name] = core_state.dir_cache.pages (core_state.root,
+          dir_name)
+      if not target in listings[dir_name]:
+         missing.add (link_num)
+   return missing
+
+def readAheadTargets (core_state):
+   """Returns the pages worth reading ahead of time: the target of the
+   selected link, and the next READ_AHEAD_PAGES pages of the forward
+   history, in that order.
+   """
+
+   targets = []
+   target = selectedLinkTarget (core_state)
+   if None != target:
+      targets.append (target)
+   history = core_state.history
+   for index in xrange (core_state.history_position + 1,
+    min (len (history), core_state.history_position + 1 + READ_AHEAD_PAGES)):
+      targets.append (history.get (index).filename)
+   return targets
+
+def sessionFilename (root, kind = ""):
+   """Returns the name of the file the session of the collection at ROOT
+   is kept in: one in SESSION_DIR named for the collection's absolute
+   path, so that every collection a user views has one session, and
+   every user their own.  If KIND is given, it names a subdirectory of
+   SESSION_DIR keeping something else of the collection's per user in
+   the same way, such as the visit counts.
+   """
+
+   path = os.path.realpath (root)
+   return os.path.join (os.path.expanduser (SESSION_DIR), kind,
+    path.replace ("%", "%25").replace (os.sep, "%2F"))
+
+def saveSession (core_state):
+   """Saves the viewer's session in the user's session directory (see
+   sessionFilename): the history, where the viewer was on every page in
+   it, and a manifest of the pages it has read lately (see
+   restoreSession).
+   """
+
+   if None != core_state.location:
+      core_state.history.put (core_state.history_position,
+       core_state.location)
+   filenames, positions = core_state.history.pack ()
+   saveCacheFile (sessionFilename (core_state.root), {
+      "filenames": filenames,
+      "positions": positions,
+      "history_position": core_state.history_position,
+      "manifest": core_state.page_cache.names (
+       core_state.root)[:SESSION_MANIFEST_SIZE]
+   })
+
+def restoreSession (core_state):
+   """Restores the session saved by saveSession into the viewer's history,
+   without reading any pages.  Returns the manifest of pages that were
+   in the page cache, or None if there is no session to restore (or the
+   page it was on is gone).
+   """
+
+   session = loadCacheFile (sessionFilename (core_state.root))
+   if None == session:
+      return None
+   try:
+      history_position = session["history_position"]
+      if None == pageStorage (os.path.join (core_state.root,
+       session["filenames"][history_position])):
+         return None
+      dropped = core_state.history.unpack (session["filenames"],
+       session["positions"])
+   except (KeyError, IndexError, TypeError, ValueError):
+      return None
+   core_state.history_position = max (0, history_position - dropped)
+   core_state.location = None
+   return session["manifest"]
+
+def warmPageCache (page_cache, root, filenames, should_stop):
+   """Reads the pages FILENAMES of the collection at ROOT into PAGE_CACHE,
+   unless they are there already, giving up as soon as SHOULD_STOP
+   returns True.  This is the body of the thread started by
+   startWarmingPageCache.
+   """
+
+   for filename in filenames:
+      if should_stop ():
+         break
+      try:
+         readPage (filename, page_cache, root)
+      except (IOError, OSError):
+         pass
+
+def startWarmingPageCache (core_state, filenames):
+   """Starts reading the pages FILENAMES into the page cache in the
+   background.  stopWarmingPageCache stops it.
+   """
+
+   stop = threading.Event ()
+   thread = threading.Thread (target = warmPageCache,
+    args = (core_state.page_cache, core_state.root, filenames, stop.isSet))
+   thread.setDaemon (True)
+   core_state.warmer = (thread, stop)
+   thread.start ()
+
+def stopWarmingPageCache (core_state):
+   if None != core_state.warmer:
+      thread, stop = core_state.warmer
+      stop.set ()
+      thread.join ()
+      core_state.warmer = None
+
+def readHyltFile (filename, page):
+   """Given a particular filename, this function parses it and fills in
+   the Page PAGE with the collection of values necessary for properly
+   handling the display and navigation of the page.  Links are resolved
+   relative to the page's curr_base_path, which must already be set.
 
    The parser is a finite state machine.  The FSM is actually line-based,
    and resets at the end of each line; this means that links cannot span
    newlines.
+
+   Besides what the viewer needs, it records where every link starts in
+   the file, as (line, column) pairs counted from 1 in the same order as
+   the link list, and every link that was dropped for escaping the
+   sandbox, as (link, line, column) tuples.
    """
    
    data_array = []
 
-   curr_base_path = core_state["curr_base_path"]
-   file = open (filename, "r")
+   curr_base_path = page.curr_base_path
+   file = openPage (filename)
    curr_state = "text"
    curr_link = None
    link_count = 0
    link_list = []
+   link_positions = []
+   escaped_links = []
    max_width = 0
    has_data = False
    for line in file:
       
       new_array_line = []
-      for char in line.rstrip ():
+      for col_num, char in enumerate (line.rstrip ()):
          if curr_state == "text":
             if '[' == char:
                curr_state = "firstopenbracket"
+               link_position = (len (data_array) + 1, col_num + 1)
             elif '\\' == char:
                curr_state = "textescape"
             else:
@@ -228,6 +2211,7 @@ def readHyltFile (filename, core_state):
 
                   # Add the link to the list of links.
                   link_list.append (raw_link)
+                  link_positions.append (link_position)
 
                   # We've got the full link name.  Put it into the array, with
                   # links.  Gotta kill the path first, though.
@@ -243,7 +2227,9 @@ def readHyltFile (filename, core_state):
                   link_count += 1
                   has_data = True
 
-               # else do nothing; this wasn't a valid link.
+               # Otherwise this wasn't a valid link; just remember it.
+               else:
+                  escaped_links.append ((raw_link,) + link_position)
             else:
                curr_state = "link_filename"
                link_filename += ']'
@@ -266,12 +2252,15 @@ def readHyltFile (filename, core_state):
 
                   # Add the link to the list of links.
                   link_list.append (raw_link)
+                  link_positions.append (link_position)
                   
                   # Add the pretty version of the link name to the array.
                   for link_char in link_text:
                      new_array_line.append ((link_char, link_count))
                   link_count += 1
                   has_data = True
+               else:
+                  escaped_links.append ((raw_link,) + link_position)
             else:
                curr_state = "pretty_link"
                link_text += ']'
@@ -291,12 +2280,14 @@ def readHyltFile (filename, core_state):
    if not has_data:
       data_array = [[(' ', None)]]
 
-   # Done.  Add the data array and link list to the state.
-   core_state["data_array"] = data_array
-   core_state["link_list"] = link_list
-   core_state["link_count"] = link_count
-   core_state["mx"] = max_width
-   core_state["my"] = len (data_array)
+   # Done.  Add the data array and link list to the page.
+   page.data_array = data_array
+   page.link_list = link_list
+   page.link_positions = link_positions
+   page.escaped_links = escaped_links
+   page.link_count = link_count
+   page.mx = max_width
+   page.my = len (data_array)
    file.close ()
 
 def displayPage (screen, core_state):
@@ -305,22 +2296,24 @@ def displayPage (screen, core_state):
    of the screen), and so on.
    """
 
-   if core_state["history_position"] < 0:
+   if core_state.history_position < 0:
       return
 
-   current_loc = core_state["history"][core_state["history_position"]]
+   current_loc = core_state.currentLocation ()
    
    # Print everything we can fit starting where the cursor is.
    screen.clear ()
    display_y = 0
-   cy = current_loc["cy"]
-   cx = current_loc["cx"]
-   data_array = core_state["data_array"]
-   selected_link = current_loc["selected_link"]
-   for row_num in range (cy, min (len (data_array), cy + core_state["y"] - 2)):
+   cy = current_loc.cy
+   cx = current_loc.cx
+   data_array = core_state.page.data_array
+   selected_link = current_loc.selected_link
+   missing_links = missingLinks (core_state)
+   highlights = highlightedCells (core_state, cy, cy + core_state.y - 2)
+   for row_num in range (cy, min (len (data_array), cy + core_state.y - 2)):
       display_x = 0
       curr_row = data_array[row_num]
-      for col_num in range (cx, min (len (curr_row), cx + core_state["x"] - 1)):
+      for col_num in range (cx, min (len (curr_row), cx + core_state.x - 1)):
          (curr_char, curr_link) = curr_row[col_num]
 
          if None == curr_link:
@@ -331,11 +2324,19 @@ def displayPage (screen, core_state):
 
             # Selected link. Inverse.
             attribute = curses.A_REVERSE
+         elif curr_link in missing_links:
+
+            # A link to a page that doesn't exist yet.  Dim it.
+            attribute = curses.A_DIM
          else:
 
             # Bold it; it's a link, but not a selected one.
             attribute = curses.A_BOLD
 
+         # Underline anything the in-page search matched.
+         if highlights and (row_num, col_num) in highlights:
+            attribute |= curses.A_UNDERLINE
+
          # Display and increment the column.
          screen.addch (display_y, display_x, curr_char, attribute)
          display_x += 1
@@ -366,7 +2367,7 @@ def displayHeader (screen, core_state):
    """Displays the header for the Hylt page.
    """
 
-   displayNote (screen, core_state["title"], core_state["x"])
+   displayNote (screen, core_state.page.title, core_state.x)
 
 def displayLinkInfo (screen, core_state):
    """Displays information based on the currently selected link on
@@ -374,15 +2375,19 @@ def displayLinkInfo (screen, core_state):
    appropriate message.
    """
    
-   if core_state["history_position"] < 0:
+   if core_state.history_position < 0:
       return
 
-   link_num = core_state["history"][core_state["history_position"]]["selected_link"]
-   link_list = core_state["link_list"]
+   link_num = core_state.currentLocation ().selected_link
+   link_list = core_state.page.link_list
    if None != link_num:
-      displayNote (screen, link_list[link_num], core_state["x"])
+      note = link_list[link_num]
+      if not core_state.dir_cache.exists (core_state.root,
+       selectedLinkTarget (core_state)):
+         note += "  (not created yet)"
+      displayNote (screen, note, core_state.x)
    else:
-      displayNote (screen, "No links exist on this page.", core_state["x"])
+      displayNote (screen, "No links exist on this page.", core_state.x)
 
 def displayNote (screen, note, screen_width, attribute = curses.A_REVERSE):
    """Displays a 'note'--a single line of text, typically to the top
@@ -425,22 +2430,22 @@ def moveCursorForLink (core_state, direction):
    appears near the top of the page, etc.
    """
 
-   if core_state["history_position"] < 0:
+   if core_state.history_position < 0:
       return
 
-   data_array = core_state["data_array"]
+   data_array = core_state.page.data_array
 
    if direction > 0:
       loc = 0
    else:
-      loc = core_state["my"] - 1
+      loc = core_state.page.my - 1
 
    curr_line = data_array[loc]
    link_y = 0
    done = False
    while not done:
       for char, link in curr_line:
-         if link == core_state["history"][core_state["history_position"]]["selected_link"]:
+         if link == core_state.currentLocation ().selected_link:
             done = True
             link_y = loc
       if not done:
@@ -448,21 +2453,21 @@ def moveCursorForLink (core_state, direction):
             loc += 1
          else:
             loc -= 1
-         if (loc < 0) or (loc > core_state["my"] - 1):
+         if (loc < 0) or (loc > core_state.page.my - 1):
             done = True
          else:
             curr_line = data_array[loc]
 
    # Okay, we have the link's y location.  If it's on the current page, don't
    # move; otherwise, do the minimal movement that gets us there.
-   curr_top = core_state["history"][core_state["history_position"]]["cy"]
-   curr_bottom = curr_top + core_state["y"] - 3
+   curr_top = core_state.currentLocation ().cy
+   curr_bottom = curr_top + core_state.y - 3
    if link_y < curr_top:
       distance = curr_top - link_y
-      core_state["history"][core_state["history_position"]]["cy"] -= distance + 1
+      core_state.currentLocation ().cy -= distance + 1
    elif link_y > curr_bottom:
       distance = link_y - curr_bottom
-      core_state["history"][core_state["history_position"]]["cy"] += distance + 1
+      core_state.currentLocation ().cy += distance + 1
       
    # else do nothing; it's on this page.
 
@@ -473,16 +2478,167 @@ def fixCursorCoords (core_state):
    screen display can fix them up.
    """
    
-   if core_state["history_position"] >= 0:
-      curr_location = core_state["history"][core_state["history_position"]]
-      if 0 > curr_location["cx"]:
-         curr_location["cx"] = 0
-      elif curr_location["cx"] > core_state["mx"] - 1:
-         curr_location["cx"] = core_state["mx"] - 1
-      if 0 > curr_location["cy"]:
-         curr_location["cy"] = 0
-      elif curr_location["cy"] > core_state["my"] - 1:
-         curr_location["cy"] = core_state["my"] - 1
+   if core_state.history_position >= 0:
+      curr_location = core_state.currentLocation ()
+      if 0 > curr_location.cx:
+         curr_location.cx = 0
+      elif curr_location.cx > core_state.page.mx - 1:
+         curr_location.cx = core_state.page.mx - 1
+      if 0 > curr_location.cy:
+         curr_location.cy = 0
+      elif curr_location.cy > core_state.page.my - 1:
+         curr_location.cy = core_state.page.my - 1
+
+def findPageMatches (core_state):
+   """Returns the matches of the in-page search on the current page, as a
+   sorted list of (row, column) pairs where the query starts, or an
+   empty list if there is no in-page search.  Matching ignores case.
+
+   The matches are worked out once per query and kept along with the
+   matches of every shorter query typed on the way to it, so that
+   typing another character only has to check the places the query
+   matched before it, and deleting one costs nothing.  They are worked
+   out again from scratch if the page is reloaded.
+   """
+
+   page_search = core_state.page_search
+   if None == page_search or "" == page_search["query"]:
+      return []
+   if page_search["data_array"] is not core_state.page.data_array:
+      page_search["data_array"] = core_state.page.data_array
+      page_search["lines"] = [line.lower () for line in
+       pageLines (core_state.page.data_array)]
+      page_search["found"] = []
+      page_search["position"] = None
+
+   query = page_search["query"]
+   found = page_search["found"]
+   while found and not query.startswith (found[-1][0]):
+      found.pop ()
+   if found and found[-1][0] == query:
+      return found[-1][1]
+
+   lines = page_search["lines"]
+   if found:
+      matches = [(row, col) for row, col in found[-1][1] if
+       lines[row].startswith (query, col)]
+   else:
+      matches = []
+      for row in [row for row in xrange (len (lines)) if query in lines[row]]:
+         col = lines[row].find (query)
+         while -1 != col:
+            matches.append ((row, col))
+            col = lines[row].find (query, col + 1)
+   found.append ((query, matches))
+   return matches
+
+def highlightedCells (core_state, first_row, last_row):
+   """Returns the set of (row, column) cells between FIRST_ROW and just
+   before LAST_ROW that are part of an in-page search match.
+   """
+
+   matches = findPageMatches (core_state)
+   if not matches:
+      return set ()
+   length = len (core_state.page_search["query"])
+   cells = set ()
+   for row, col in matches[bisect.bisect_left (matches, (first_row, 0)):
+    bisect.bisect_left (matches, (last_row, 0))]:
+      for cell_col in xrange (col, col + length):
+         cells.add ((row, cell_col))
+   return cells
+
+def jumpToPageMatch (core_state, direction, inclusive = False):
+   """Moves the view to the next (DIRECTION 1) or previous (DIRECTION -1)
+   in-page search match, wrapping around the ends of the page.  "Next"
+   is counted from the last match jumped to, or from the top of the
+   view if there isn't one; with INCLUSIVE, the match it is counted
+   from can be jumped to again.  Returns a note saying where it went.
+   """
+
+   matches = findPageMatches (core_state)
+   if not matches:
+      return "Not found: " + core_state.page_search["query"]
+
+   current_loc = core_state.currentLocation ()
+   start = core_state.page_search["position"]
+   if None == start:
+      start = (current_loc.cy, 0)
+      inclusive = True
+   if 1 == direction:
+      if inclusive:
+         match_num = bisect.bisect_left (matches, start)
+      else:
+         match_num = bisect.bisect_right (matches, start)
+      match_num %= len (matches)
+   else:
+      if inclusive:
+         match_num = bisect.bisect_right (matches, start) - 1
+      else:
+         match_num = bisect.bisect_left (matches, start) - 1
+      match_num %= len (matches)
+   row, col = core_state.page_search["position"] = matches[match_num]
+
+   # Only scroll if the match isn't on screen already.
+   length = len (core_state.page_search["query"])
+   rows = core_state.y - 2
+   cols = core_state.x - 1
+   if row < current_loc.cy or row >= current_loc.cy + rows:
+      current_loc.cy = row - rows / 3
+   if col < current_loc.cx or col + length > current_loc.cx + cols:
+      current_loc.cx = col - cols / 2
+   return "Match %d of %d: %s" % (match_num + 1, len (matches),
+    core_state.page_search["query"])
+
+def searchInPage (screen, bottom, core_state):
+   """Displays an in-page search prompt on the bottom line.  Every key
+   typed moves the view to the first match of what has been typed so
+   far, starting from where the search started, and redraws SCREEN
+   with the matches underlined.  Enter keeps the search for the 'n'
+   and 'N' keys; Escape throws it away and goes back to where the
+   search started.
+   """
+
+   current_loc = core_state.currentLocation ()
+   old_search = core_state.page_search
+   start_cx, start_cy = current_loc.cx, current_loc.cy
+   core_state.page_search = {"query": "", "position": None,
+    "data_array": None}
+   bottom.keypad (1)
+   note = ""
+   while True:
+      displayPage (screen, core_state)
+      displayNote (bottom, "/" + core_state.page_search["query"] +
+       "   " + note, core_state.x - 1)
+      curses.doupdate ()
+
+      keypress = bottom.getch ()
+      if 10 == keypress or curses.KEY_ENTER == keypress:
+
+         # An empty search keeps the last one, like it does in vi.
+         if "" == core_state.page_search["query"]:
+            core_state.page_search = old_search
+         return
+      elif 27 == keypress:
+         current_loc.cx, current_loc.cy = start_cx, start_cy
+         core_state.page_search = old_search
+         return
+      elif (curses.KEY_BACKSPACE == keypress or 127 == keypress or
+       8 == keypress):
+         core_state.page_search["query"] = (
+          core_state.page_search["query"][:-1])
+      elif 32 <= keypress < 127:
+         core_state.page_search["query"] += chr (keypress).lower ()
+      else:
+         continue
+
+      current_loc.cx, current_loc.cy = start_cx, start_cy
+      core_state.page_search["position"] = None
+      if "" == core_state.page_search["query"]:
+         note = ""
+      else:
+         note = jumpToPageMatch (core_state, 1)
+      fixCursorCoords (core_state)
 
 def safePath (path):
    """Check the attempted path to make sure that it doesn't
@@ -512,47 +2668,1159 @@ def regexpSearchDirtree (path, expression):
 
    regexp = re.compile (expression, re.IGNORECASE)
    matches = []
-   for root, dirs, files in os.walk (path):
-      for file in files:
-         current = os.path.join (root, file)
-
-         # There are two criteria for adding a found file to our list:
-         # - It must match the search (obviously); and
-         # - It must end in .hylt.  We don't want spurious results.
-         if (regexp.search (current) and len (current) > 5 and
-          ".hylt" == current[-5:]):
+   for dir_name, pages, subdirs in walkCollection (path, sort = True):
+      for page in pages:
+         current = os.path.join (path, page)
+
+         # Only Hylt files are ever listed, so the search is the only
+         # criterion for adding a found file to our list.
+         if regexp.search (current):
             matches.append (current)
    return matches
 
+def isPlainData (value):
+   """Returns True if VALUE is made of nothing but PLAIN_TYPES, all the
+   way down.
+   """
+
+   pending = [value]
+   while pending:
+      value = pending.pop ()
+      value_type = type (value)
+      if not value_type in PLAIN_TYPES:
+         return False
+      if dict == value_type:
+         pending.extend (value.keys ())
+         pending.extend (value.values ())
+      elif value_type in (list, tuple, set, frozenset):
+         pending.extend (value)
+   return True
+
+def loadCollectionCache (root, name):
+   """Loads the cache called NAME from the cache directory of the
+   collection at ROOT (see loadCacheFile).
+   """
+
+   return loadCacheFile (os.path.join (root, CACHE_DIR, name))
+
+def saveCollectionCache (root, name, cache):
+   """Saves the cache dictionary CACHE as NAME in the cache directory of
+   the collection at ROOT (see saveCacheFile).
+   """
+
+   saveCacheFile (os.path.join (root, CACHE_DIR, name), cache)
+
+def loadCacheFile (filename):
+   """Loads the cache saved in FILENAME by saveCacheFile.  Returns None
+   if there is no such cache, or if it can't be read for any reason
+   (including holding anything but PLAIN_TYPES); caches can always be
+   rebuilt.
+   """
+
+   try:
+      cache_file = open (filename, "rb")
+      try:
+         cache = marshal.load (cache_file)
+      finally:
+         cache_file.close ()
+   except:
+      return None
+
+   if (not isinstance (cache, dict) or
+    CACHE_VERSION != cache.get ("version") or not isPlainData (cache)):
+      return None
+   return cache
+
+def saveCacheFile (filename, cache):
+   """Saves the cache dictionary CACHE in FILENAME, making its directory
+   if need be.  The cache is written to a temporary file and renamed
+   into place, so a reader never sees half of it.  Failing to save (a
+   read-only collection, say) is not an error.
+   """
+
+   cache["version"] = CACHE_VERSION
+   cache_dir = os.path.dirname (filename) or "."
+   temp_name = filename + ".%d.tmp" % (os.getpid ())
+   try:
+      if not os.path.isdir (cache_dir):
+         os.makedirs (cache_dir)
+      cache_file = open (temp_name, "wb")
+      try:
+         marshal.dump (cache, cache_file, 2)
+      finally:
+         cache_file.close ()
+      os.rename (temp_name, filename)
+   except (IOError, OSError):
+      try:
+         os.remove (temp_name)
+      except OSError:
+         pass
+
+def refreshPageIndex (root, index, mtime_slot, update, remove,
+ poll_state = None, should_stop = None, progress = None):
+   """Brings an index of the pages of the collection at ROOT up to date
+   with the pages on disk, going by their modification times.  The
+   index's "pages" maps every page it has to a tuple holding the page's
+   mtime at MTIME_SLOT; pages that are gone are taken out with
+   REMOVE (index, page), and pages that are new or have changed are
+   (re-)indexed with UPDATE (root, index, page).  Finding out what has
+   changed costs a stat() per page (and a listing of every directory
+   that has changed since POLL_STATE was last used, if it is given;
+   see snapshotCollection); it's the re-indexing that takes the time.
+
+   If SHOULD_STOP is given, it is called between pages, and if it
+   returns True, the refresh stops there and False is returned.  Every
+   page is indexed whole or not at all, so a stopped refresh leaves an
+   index that is merely out of date; the next refresh picks up where
+   this one left off.  If PROGRESS is given, it is called with the
+   number of pages re-indexed so far and the number there are to do
+   before every page, and once more when they are all done.
+   """
+
+   pages = index["pages"]
+   snapshot = snapshotCollection (root, poll_state)
+   for filename in pages.keys ():
+      if not filename in snapshot:
+         remove (index, filename)
+   stale = [filename for filename in sorted (snapshot.keys ())
+    if not filename in pages or
+    pages[filename][mtime_slot] != snapshot[filename]]
+   for done in xrange (len (stale)):
+      if None != progress:
+         progress (done, len (stale))
+      if None != should_stop and should_stop ():
+         return False
+      update (root, index, stale[done])
+   if None != progress and stale:
+      progress (len (stale), len (stale))
+   return True
+
+def loadTextIndex (root):
+   """Loads the full-text index of the collection at ROOT, without
+   bringing it up to date (see refreshTextIndex).  The index is a
+   dictionary with:
+   - "pages": maps every indexed page to (page number, mtime, its terms
+     joined by spaces);
+   - "names": maps page numbers back to pages (None for removed pages);
+   - "postings": maps every term to the pages it is on, as an array of
+     page number, count, page number, count ... (see unpackPostings);
+   - "dirty": True if it has changed since it was last saved.
+   """
+
+   index = loadCollectionCache (root, "text-index")
+   if None == index:
+      index = {"pages": {}, "names": [], "postings": {}}
+   index["dirty"] = False
+   return index
+
+def refreshTextIndex (root, index, poll_state = None, should_stop = None,
+ progress = None):
+   """Brings a full-text index up to date with the pages on disk, as per
+   refreshPageIndex.  Returns False if SHOULD_STOP stopped it early.
+   """
+
+   return refreshPageIndex (root, index, 1, updateTextIndex,
+    removeFromTextIndex, poll_state, should_stop, progress)
+
+def unpackPostings (postings, term):
+   """Returns the postings of TERM as an array that can be changed in
+   place.  Postings are saved as strings, which marshal far more
+   compactly and quickly than anything else, and only turned back
+   into arrays when they are needed.
+   """
+
+   entries = postings[term]
+   if isinstance (entries, str):
+      packed = entries
+      entries = array.array ("I")
+      entries.fromstring (packed)
+      postings[term] = entries
+   return entries
+
+def removeFromTextIndex (index, filename):
+   """Removes a page from a full-text index.  Returns the page's number
+   so that it can be reused if the page is being re-indexed.
+   """
+
+   postings = index["postings"]
+   page_id, mtime, terms = index["pages"].pop (filename)
+   index["names"][page_id] = None
+   for term in terms.split ():
+      entries = unpackPostings (postings, term)
+      for i in range (0, len (entries), 2):
+         if entries[i] == page_id:
+            del entries[i:i + 2]
+            break
+      if not entries:
+         del postings[term]
+   index["dirty"] = True
+   return page_id
+
+def updateTextIndex (root, index, filename):
+   """(Re-)indexes a single page of the collection at ROOT, given relative
+   to ROOT.  If the page no longer exists, it is removed from the index.
+   """
+
+   filename = os.path.normpath (filename)
+   page_id = None
+   if filename in index["pages"]:
+      page_id = removeFromTextIndex (index, filename)
+   try:
+      mtime = pageMtime (os.path.join (root, filename))
+      counts = countTerms (parsePage (root, filename).data_array, filename)
+   except (IOError, OSError):
+      return
+
+   names = index["names"]
+   if None == page_id:
+      page_id = len (names)
+      names.append (filename)
+   else:
+      names[page_id] = filename
+
+   postings = index["postings"]
+   for term, count in counts.items ():
+      if term in postings:
+         entries = unpackPostings (postings, term)
+      else:
+         entries = postings[intern (term)] = array.array ("I")
+      entries.append (page_id)
+      entries.append (count)
+   index["pages"][filename] = (page_id, mtime, " ".join (counts.keys ()))
+   index["dirty"] = True
+
+def searchTextIndex (index, query):
+   """Returns the pages of a full-text index containing every word in
+   QUERY, best match first.  Pages are ranked by the usual tf-idf sum:
+   every word scores the number of times it is on the page, weighted
+   by how rare the word is in the whole collection.
+   """
+
+   terms = [term for term in TERM_REGEXP.findall (query.lower ())
+    if len (term) > 1]
+   if not terms:
+      return []
+
+   postings = index["postings"]
+   page_count = float (max (len (index["pages"]), 1))
+   term_postings = []
+   for term in terms:
+      if not term in postings:
+         return []
+      entries = unpackPostings (postings, term)
+      term_postings.append (dict (zip (entries[::2], entries[1::2])))
+
+   # Intersect starting from the rarest word; it's the smallest set.
+   term_postings.sort (key = len)
+   scores = dict.fromkeys (term_postings[0], 0.0)
+   for found in term_postings:
+      weight = math.log (1.0 + page_count / len (found))
+      for page_id in scores.keys ():
+         if page_id in found:
+            scores[page_id] += found[page_id] * weight
+         else:
+            del scores[page_id]
+
+   names = index["names"]
+   return [names[page_id] for page_id in sorted (scores.keys (),
+    key = lambda page_id: (-scores[page_id], names[page_id]))]
+
+def searchPageText (core_state, query, should_stop = None, progress = None):
+   """Searches the text of the pages in the current collection, loading
+   the full-text index first if this is the first search, and bringing
+   it up to date with any pages changed since the last one (reporting
+   to PROGRESS as it goes; see refreshPageIndex).  If the refresh is
+   stopped early by SHOULD_STOP, whatever it had re-indexed is kept,
+   but nothing is found.
+   """
+
+   if None == core_state.text_index:
+      core_state.text_index = loadTextIndex (core_state.root)
+   refreshed = refreshTextIndex (core_state.root, core_state.text_index,
+    core_state.poll_state, should_stop, progress)
+   if not refreshed:
+      return []
+   return searchTextIndex (core_state.text_index, query)
+
+def saveIndexes (core_state):
+   """Saves the indexes of the current collection that have been loaded
+   and have changed since they were last saved, along with the visit
+   counts.
+   """
+
+   filename_index = core_state.filename_index
+   if None != filename_index and filename_index["dirty"]:
+      filename_index["dirty"] = False
+      saveCollectionCache (core_state.root, "filename-index", filename_index)
+
+   text_index = core_state.text_index
+   if None != text_index and text_index["dirty"]:
+      text_index["dirty"] = False
+      packPostings (text_index["postings"])
+      saveCollectionCache (core_state.root, "text-index", text_index)
+
+   trigram_index = core_state.trigram_index
+   if None != trigram_index and trigram_index["dirty"]:
+      trigram_index["dirty"] = False
+      packPostings (trigram_index["postings"])
+      saveCollectionCache (core_state.root, "trigram-index", trigram_index)
+
+   backlink_index = core_state.backlink_index
+   if None != backlink_index and backlink_index["dirty"]:
+      backlink_index["dirty"] = False
+      saveCollectionCache (core_state.root, "backlink-index", backlink_index)
+
+   visits = core_state.visits
+   if None != visits and visits["dirty"]:
+      visits["dirty"] = False
+      saveCacheFile (sessionFilename (core_state.root, "visits"), visits)
+
+def packPostings (postings):
+   """Turns all of the postings arrays of an index back into strings for
+   saving; see unpackPostings.
+   """
+
+   for key, entries in postings.items ():
+      if not isinstance (entries, str):
+         postings[key] = entries.tostring ()
+
+def noteEditedPage (core_state, filename):
+   """Tells the viewer's caches that a page may have been changed behind
+   its back, usually by the editor.
+   """
+
+   if None != core_state.text_index:
+      updateTextIndex (core_state.root, core_state.text_index, filename)
+   if None != core_state.trigram_index:
+      updateTrigramIndex (core_state.root, core_state.trigram_index, filename)
+   if None != core_state.backlink_index:
+      updateBacklinkIndex (core_state.root, core_state.backlink_index, filename)
+   core_state.page_cache.discard (os.path.join (core_state.root,
+    os.path.normpath (filename)))
+
+def loadTrigramIndex (root):
+   """Loads the trigram index of the collection at ROOT, without bringing
+   it up to date (see refreshTrigramIndex).
+
+   The trigram index records, for every run of three characters, which
+   pages contain it, so that a regular expression search only has to
+   look at the pages containing every trigram the expression requires
+   (see requiredTrigrams).  A page's "document" is its name on one
+   line followed by its text, all lowercased.  The index is a
+   dictionary with:
+   - "pages": maps every indexed page to (page number, mtime);
+   - "names": maps page numbers back to pages (None for retired ones);
+   - "postings": maps every trigram to an ascending array of the
+     numbers of the pages it appears in (see unpackPostings);
+   - "documents": maps every indexed page to its document, which the
+     pages that might match are checked against, rather than reading
+     and parsing every one of them again;
+   - "retired": the set of page numbers that are no longer in use;
+   - "dirty": True if it has changed since it was last saved.
+
+   Pages are never removed from the postings, which would mean working
+   out every trigram they used to have.  Instead, a page that changes
+   is simply given a new number, and the old one is retired; retired
+   numbers are dropped from search results, and from the postings
+   themselves once there are too many of them (see compactTrigramIndex).
+   """
+
+   index = loadCollectionCache (root, "trigram-index")
+   if None == index or not "documents" in index:
+      index = {"pages": {}, "names": [], "postings": {}, "documents": {},
+       "retired": set ()}
+   index["dirty"] = False
+   return index
+
+def refreshTrigramIndex (root, index, poll_state = None, should_stop = None,
+ progress = None):
+   """Brings a trigram index up to date with the pages on disk, as per
+   refreshPageIndex, compacting it if it has retired too many pages.
+   Returns False if SHOULD_STOP stopped it early.
+   """
+
+   if not refreshPageIndex (root, index, 1, updateTrigramIndex,
+    retireTrigramPage, poll_state, should_stop, progress):
+      return False
+   if len (index["retired"]) > len (index["pages"]):
+      compactTrigramIndex (index)
+   return True
+
+def retireTrigramPage (index, filename):
+   """Removes a page from a trigram index by retiring its number.
+   """
+
+   page_id, mtime = index["pages"].pop (filename)
+   del index["documents"][filename]
+   index["names"][page_id] = None
+   index["retired"].add (page_id)
+   index["dirty"] = True
+
+def updateTrigramIndex (root, index, filename):
+   """(Re-)indexes a single page of the collection at ROOT, given relative
+   to ROOT.  If the page no longer exists, it is removed from the index.
+   """
+
+   filename = os.path.normpath (filename)
+   if filename in index["pages"]:
+      retireTrigramPage (index, filename)
+   try:
+      mtime = pageMtime (os.path.join (root, filename))
+      lines = pageLines (parsePage (root, filename).data_array)
+   except (IOError, OSError):
+      return
+
+   names = index["names"]
+   page_id = len (names)
+   names.append (filename)
+
+   # Page numbers only ever go up, so appending keeps every array of
+   # postings in order.
+   postings = index["postings"]
+   document = (filename + "\n" + "\n".join (lines)).lower ()
+   for trigram in set ([document[i:i + 3] for i in
+    xrange (len (document) - 2)]):
+      if trigram in postings:
+         unpackPostings (postings, trigram).append (page_id)
+      else:
+         postings[trigram] = array.array ("I", [page_id])
+   index["pages"][filename] = (page_id, mtime)
+   index["documents"][filename] = document
+   index["dirty"] = True
+
+def compactTrigramIndex (index):
+   """Drops the retired page numbers from a trigram index, renumbering
+   the pages that are left.
+   """
+
+   renumber = {}
+   names = []
+   for page_id in range (len (index["names"])):
+      filename = index["names"][page_id]
+      if None != filename:
+         renumber[page_id] = len (names)
+         index["pages"][filename] = (len (names),
+          index["pages"][filename][1])
+         names.append (filename)
+
+   postings = index["postings"]
+   for trigram in postings.keys ():
+      entries = array.array ("I", [renumber[page_id] for page_id in
+       unpackPostings (postings, trigram) if page_id in renumber])
+      if entries:
+         postings[trigram] = entries
+      else:
+         del postings[trigram]
+
+   index["names"] = names
+   index["retired"] = set ()
+   index["dirty"] = True
+
+def requiredLiterals (parsed):
+   """Given a regular expression as parsed by sre_parse, returns a list
+   of strings that every match of it has to contain.  This is
+   conservative: anything complicated (alternatives, character classes,
+   optional bits) simply ends the current string.
+   """
+
+   literals = []
+   current = []
+   for op, value in parsed:
+      if sre_constants.LITERAL == op and value < 256:
+         current.append (chr (value).lower ())
+         continue
+
+      if len (current):
+         literals.append ("".join (current))
+         current = []
+      if sre_constants.SUBPATTERN == op and None != value[-1]:
+         literals.extend (requiredLiterals (value[-1]))
+      elif (sre_constants.MAX_REPEAT == op or
+       sre_constants.MIN_REPEAT == op) and value[0] >= 1:
+         literals.extend (requiredLiterals (value[2]))
+
+   if len (current):
+      literals.append ("".join (current))
+   return literals
+
+def requiredTrigrams (expression):
+   """Returns the set of (lowercased) trigrams that any text matching a
+   regular expression has to contain.  An empty set means the
+   expression can't narrow a search down at all.
+   """
+
+   trigrams = set ()
+   for literal in requiredLiterals (sre_parse.parse (expression)):
+      for i in range (len (literal) - 2):
+         trigrams.add (literal[i:i + 3])
+   return trigrams
+
+def searchTrigramIndex (index, expression):
+   """Returns the sorted list of pages of a trigram index that might
+   match a regular expression; only these have to be checked for real.
+   """
+
+   postings = index["postings"]
+   candidates = None
+   by_size = []
+   for trigram in requiredTrigrams (expression):
+      if not trigram in postings:
+         return []
+      by_size.append (unpackPostings (postings, trigram))
+
+   # Start from the rarest trigram; it's the smallest set.
+   by_size.sort (key = len)
+   for entries in by_size:
+      if None == candidates:
+         candidates = set (entries)
+      else:
+         candidates.intersection_update (entries)
+      if not candidates:
+         return []
+
+   names = index["names"]
+   if None == candidates:
+      return sorted ([filename for filename in names if None != filename])
+   return sorted ([names[page_id] for page_id in candidates
+    if None != names[page_id]])
+
+def iterSearchPageRegexp (core_state, expression, should_stop = None,
+ progress = None):
+   """Yields the pages of the current collection whose name or text
+   matches a regular expression, in order, loading the trigram index
+   first if this is the first search, and bringing it up to date with
+   any pages changed since the last one (reporting to PROGRESS as it
+   goes; see refreshPageIndex).  The trigram index narrows the
+   search down to the pages that could possibly match; only the
+   documents of those (see loadTrigramIndex) are checked against the
+   expression itself.  If SHOULD_STOP
+   stops the refresh early, whatever it had re-indexed is kept, but
+   nothing is found.
+   """
+
+   # The documents are all lowercase already, so unless the expression
+   # has capitals in it (which might be escapes like \S or \W), it can
+   # be matched without IGNORECASE, which is several times faster.
+   flags = re.MULTILINE
+   if expression != expression.lower ():
+      flags |= re.IGNORECASE
+   regexp = re.compile (expression, flags)
+   if None == core_state.trigram_index:
+      core_state.trigram_index = loadTrigramIndex (core_state.root)
+   refreshed = refreshTrigramIndex (core_state.root,
+    core_state.trigram_index, core_state.poll_state, should_stop, progress)
+   if not refreshed:
+      return
+
+   documents = core_state.trigram_index["documents"]
+   for filename in searchTrigramIndex (core_state.trigram_index,
+    expression):
+      if None != should_stop and should_stop ():
+         return
+      if regexp.search (documents[filename]):
+         yield filename
+
+def loadBacklinkIndex (root):
+   """Loads the backlink index of the collection at ROOT, without bringing
+   it up to date (see refreshBacklinkIndex).  The index is a
+   dictionary with:
+   - "pages": maps every indexed page to (mtime, the pages it links to);
+   - "backlinks": maps every page that is linked to, whether it exists
+     or not, to the set of pages that link to it;
+   - "dirty": True if it has changed since it was last saved.
+   Pages are named relative to ROOT, and links are resolved exactly as
+   buildLinkGraph resolves them.
+   """
+
+   index = loadCollectionCache (root, "backlink-index")
+   if None == index:
+      index = {"pages": {}, "backlinks": {}}
+   index["dirty"] = False
+   return index
+
+def refreshBacklinkIndex (root, index, poll_state = None, should_stop = None,
+ progress = None):
+   """Brings a backlink index up to date with the pages on disk, as per
+   refreshPageIndex.  Returns False if SHOULD_STOP stopped it early.
+   """
+
+   return refreshPageIndex (root, index, 0, updateBacklinkIndex,
+    removeFromBacklinkIndex, poll_state, should_stop, progress)
+
+def removeFromBacklinkIndex (index, filename):
+   """Removes a page, and the links on it, from a backlink index.
+   """
+
+   mtime, targets = index["pages"].pop (filename)
+   backlinks = index["backlinks"]
+   for target in targets:
+      backlinks[target].discard (filename)
+      if not backlinks[target]:
+         del backlinks[target]
+   index["dirty"] = True
+
+def updateBacklinkIndex (root, index, filename):
+   """(Re-)indexes the links on a single page of the collection at ROOT,
+   given relative to ROOT.  If the page no longer exists, it is removed
+   from the index.
+   """
+
+   filename = os.path.normpath (filename)
+   if filename in index["pages"]:
+      removeFromBacklinkIndex (index, filename)
+   try:
+      mtime = pageMtime (os.path.join (root, filename))
+      link_list = parsePage (root, filename).link_list
+   except (IOError, OSError):
+      return
+
+   base_path = os.path.dirname (filename)
+   targets = set ([os.path.normpath (os.path.join (base_path, raw_link))
+    for raw_link in link_list])
+   backlinks = index["backlinks"]
+   for target in targets:
+      if target in backlinks:
+         backlinks[target].add (filename)
+      else:
+         backlinks[target] = set ([filename])
+   index["pages"][filename] = (mtime, tuple (sorted (targets)))
+   index["dirty"] = True
+
+def searchBacklinks (core_state, filename, should_stop = None,
+ progress = None):
+   """Returns the pages of the current collection that link to a page, in
+   order, loading the backlink index first if this is the first
+   search, and bringing it up to date with any pages changed since the
+   last one (reporting to PROGRESS as it goes; see refreshPageIndex).
+   The ".hylt" can be left off the page's name.  If the refresh is
+   stopped early by SHOULD_STOP, whatever it had re-indexed is kept,
+   but nothing is found.
+   """
+
+   if None == core_state.backlink_index:
+      core_state.backlink_index = loadBacklinkIndex (core_state.root)
+   refreshed = refreshBacklinkIndex (core_state.root,
+    core_state.backlink_index, core_state.poll_state, should_stop, progress)
+   if not refreshed:
+      return []
+   filename = os.path.normpath (filename.strip ())
+   if not filename.endswith (".hylt"):
+      filename += ".hylt"
+   return sorted (core_state.backlink_index["backlinks"].get (filename,
+    ()))
+
+def loadFilenameIndex (root):
+   """Loads the filename index of the collection at ROOT, without
+   bringing it up to date (see iterRefreshFilenameIndex).  The index
+   is a dictionary with:
+   - "dirs": the pollCollection state of the collection, pages unstat()ed;
+   - "names": the sorted list of every page, as "./" plus its name
+     relative to ROOT, which is how regexpSearchDirtree names them;
+   - "dirty": True if it has changed since it was last saved.
+   """
+
+   index = loadCollectionCache (root, "filename-index")
+   if None == index:
+      index = {"dirs": {}, "names": []}
+   index["dirty"] = False
+   return index
+
+def refreshFilenameIndex (root, index):
+   """Brings a filename index up to date.  This costs one stat() per
+   directory; only directories that have changed are listed again.
+   """
+
+   for dir_name, dir_state in iterRefreshFilenameIndex (root, index):
+      pass
+
+def iterRefreshFilenameIndex (root, index):
+   """Brings a filename index up to date like refreshFilenameIndex,
+   yielding (directory, directory state) for every directory as it is
+   done, as per iterPollCollection.
+   """
+
+   changes = ([], [], [])
+   try:
+      for dir_result in iterPollCollection (root, index["dirs"], False,
+       changes):
+         yield dir_result
+   finally:
+
+      # Even a refresh that was stopped early may have found new pages.
+      changed, added, removed = changes
+      if added or removed:
+         names = []
+         for dir_state in index["dirs"].values ():
+            names.extend (["./" + filename for filename in dir_state["files"]])
+         names.sort ()
+         index["names"] = names
+         index["dirty"] = True
+
+def iterSearchFilenames (core_state, expression, should_stop = None):
+   """Yields every page of the current collection whose name matches a
+   regular expression, exactly like regexpSearchDirtree does, but
+   using the filename index instead of listing every directory, and
+   as soon as each directory has been checked.  If SHOULD_STOP is
+   given, it is called after every directory, and the search gives up
+   if it returns True; a search that matches nothing would otherwise
+   only notice it had been stopped once the whole tree was refreshed.
+   """
+
+   regexp = re.compile (expression, re.IGNORECASE)
+   if None == core_state.filename_index:
+      core_state.filename_index = loadFilenameIndex (core_state.root)
+   refresh = iterRefreshFilenameIndex (core_state.root,
+    core_state.filename_index)
+   try:
+      for dir_name, dir_state in refresh:
+         if None != should_stop and should_stop ():
+            return
+         for filename in sorted (dir_state["files"].keys ()):
+            name = "./" + filename
+            if regexp.search (name):
+               yield name
+   finally:
+      refresh.close ()
+
+def iterSearchResults (core_state, expression, should_stop, progress = None):
+   """Yields the results of a 'go to' search for EXPRESSION, as entered
+   at the smartGo prompt.  SHOULD_STOP is called every so often while
+   the search can't yield anything, and the search gives up if it
+   returns True.  Searches that have to bring an index up to date
+   first report how far along they are to PROGRESS (see
+   refreshPageIndex).
+   """
+
+   if expression.startswith (TEXT_SEARCH_PREFIX):
+      results = searchPageText (core_state,
+       expression[len (TEXT_SEARCH_PREFIX):], should_stop, progress)
+   elif expression.startswith (REGEXP_SEARCH_PREFIX):
+      results = iterSearchPageRegexp (core_state,
+       expression[len (REGEXP_SEARCH_PREFIX):], should_stop, progress)
+   elif expression.startswith (BACKLINK_SEARCH_PREFIX):
+      results = searchBacklinks (core_state,
+       expression[len (BACKLINK_SEARCH_PREFIX):], should_stop, progress)
+   else:
+      results = iterSearchFilenames (core_state, expression, should_stop)
+   for filename in results:
+      yield filename
+
+def searchWorker (search, results):
+   """The body of a background search thread: feeds the RESULTS of a
+   search to the search's queue until they run out or the search is
+   stopped, then queues None to say it's done.  The indexes the search
+   brings up to date belong to the thread until it is done; nothing
+   else touches them meanwhile, and they are saved afterwards by the
+   main thread (see stopSearch), not here.
+   """
+
+   try:
+      try:
+         for filename in results:
+            if search["stop"].isSet ():
+               break
+            search["queue"].put (filename)
+      finally:
+         results.close ()
+   except re.error, error:
+      search["error"] = "Bad search expression: " + str (error)
+   except (IOError, OSError), error:
+      search["error"] = "Search failed: " + str (error)
+   search["queue"].put (None)
+
+def startSearch (core_state, expression):
+   """Starts a 'go to' search for EXPRESSION in the background.  Matches
+   are picked up by collectSearchResults.
+   """
+
+   search = {
+      "expression": expression,
+      "queue": Queue.Queue (),
+      "stop": threading.Event (),
+      "count": 0,
+      "indexed": None,
+      "done": False,
+      "error": None
+   }
+
+   # This is called from the search thread; swapping in a new tuple is
+   # safe to do there.
+   def progress (done, total):
+      search["indexed"] = (done, total)
+
+   results = iterSearchResults (core_state, expression, search["stop"].isSet,
+    progress)
+   search["thread"] = threading.Thread (target = searchWorker,
+    args = (search, results))
+   search["thread"].setDaemon (True)
+   core_state.search = search
+   search["thread"].start ()
+
+def collectSearchResults (core_state):
+   """Moves the matches a background search has found so far into the
+   history.  The first match is jumped to; the rest are added to the
+   forward history in order.  Returns True if the current page
+   changed.
+   """
+
+   search = core_state.search
+   jumped = False
+   while True:
+      try:
+         filename = search["queue"].get_nowait ()
+      except Queue.Empty:
+         break
+      if None == filename:
+         search["done"] = True
+         break
+      if 0 == search["count"]:
+         historyCut (core_state)
+         historyAdd (core_state, filename)
+         historyMove (core_state, 1)
+         jumped = True
+      else:
+         historyAdd (core_state, filename)
+      search["count"] += 1
+   return jumped
+
+def stopSearch (core_state):
+   """Stops the background search, if there is one (or finishes up after
+   one that is done), keeping whatever it found up to now and saving
+   whatever it added to the indexes.  Returns True if the current page
+   changed.
+   """
+
+   search = core_state.search
+   if None == search:
+      return False
+   search["stop"].set ()
+   search["thread"].join ()
+   jumped = collectSearchResults (core_state)
+   core_state.search = None
+   saveIndexes (core_state)
+   return jumped
+
+def describeSearch (search):
+   """Returns a note describing how a background search is doing.
+   """
+
+   indexing = None != search["indexed"] and (
+    search["indexed"][0] < search["indexed"][1])
+   if None != search["error"]:
+      return search["error"]
+   if search["done"] and not indexing:
+      if 0 == search["count"]:
+         return "No matching files found"
+      return "%d matching files found" % (search["count"])
+   if indexing:
+      if search["stop"].isSet () or search["done"]:
+         return ("Search stopped; %d of %d pages indexed so far" %
+          search["indexed"])
+      return ("Indexing pages for: %s (%d of %d; press any key to stop)" %
+       ((search["expression"],) + search["indexed"]))
+   if search["stop"].isSet ():
+      return "Search stopped; %d matching files found" % (search["count"])
+   return ("Searching for: %s (%d found; press any key to stop)" %
+    (search["expression"], search["count"]))
+
 def smartGo (screen, core_state):
-   """Displays a 'go to' prompt on the screen; the input from that is
-   fed to regexpSearchDirtree, and that output is passed out to the
-   caller.
+   """Displays a 'go to' prompt on the screen and returns what was typed.
+   The search itself is run in the background by startSearch; it is
+   the equivalent of regexpSearchDirtree, unless the input starts
+   with TEXT_SEARCH_PREFIX, in which case the rest of it is a list of
+   words to look for in the text of the pages, or with
+   REGEXP_SEARCH_PREFIX, in which case the rest of it is a regular
+   expression to match against the names and text of the pages, or
+   with BACKLINK_SEARCH_PREFIX, in which case the rest of it is the
+   name of a page to find the pages linking to.
    """
 
    prompt = "Go to: "
-   displayNote (screen, prompt, core_state["x"] - 1)
+   displayNote (screen, prompt, core_state.x - 1)
    curses.curs_set (1)
    curses.echo ()
    expression = screen.getstr (0, len (prompt))
    curses.noecho ()
    curses.curs_set (0)
-   displayNote (screen, "Searching for: " + expression, core_state["x"] - 1)
-   return regexpSearchDirtree (".", expression)
+   return expression
+
+def buildTitleTable (names):
+   """Builds the table that findPage matches against from the "names"
+   of a filename index.  Every page gets a key of its title and its
+   name (without the "./" or ".hylt", which every page has), lowercased
+   and separated by a tab, so that what is typed can be matched against
+   both at once; the keys are listed shortest title first, which is the
+   order pages that match equally well and have been visited equally
+   often are listed in.
+
+   So that rankTitles can find the titles starting with what is typed,
+   or with a word in them starting with it, without looking at any
+   others, the keys are also kept in plain sorted order ("sorted"), and
+   so is the rest of every key from each word of its title but the
+   first on ("words"; "word_keys" maps them back to their keys).
+   """
+
+   keys = []
+   pages = {}
+   word_keys = {}
+   for name in names:
+      title = generateTitle (name).lower ()
+      key = title + "\t" + name[2:-5].lower ()
+      keys.append (key)
+      pages[key] = name
+      position = title.find (" ")
+      while -1 != position:
+         word_keys[key[position + 1:]] = key
+         position = title.find (" ", position + 1)
+
+   # Sorting plain strings is far quicker than sorting tuples, and the
+   # sort is stable, so sorting the sorted keys by title length alone
+   # puts them in order of title length, then key.
+   sorted_keys = sorted (keys)
+   keys = sorted (sorted_keys, key = lambda key: key.index ("\t"))
+   return {"names": names, "keys": keys, "pages": pages,
+    "sorted": sorted_keys, "words": sorted (word_keys),
+    "word_keys": word_keys}
+
+def orderTitleTable (table, visits):
+   """Returns the keys of a title table with the pages that have been
+   visited the most first, and the rest in the order of the table.
+   """
+
+   pages = table["pages"]
+   visited = [key for key in table["keys"] if pages[key] in visits]
+   visited.sort (key = lambda key: -visits[pages[key]])
+   seen = set (visited)
+   return visited + [key for key in table["keys"] if key not in seen]
+
+def fuzzyRegexp (query):
+   """Returns a regular expression that matches (with match, not search)
+   strings with the characters of QUERY in them in order, with anything
+   in between them.  Each gap only skips characters that aren't the
+   next one wanted, so the first of each is the one matched, and the
+   expression never has to backtrack or start over from a later one.
+   """
+
+   pattern = ""
+   for char in query:
+      pattern += "[^" + re.escape (char) + "]*" + re.escape (char)
+   return re.compile (pattern)
 
-def generateConfiguration ():
-   """Generate a configuration for a given instance of Hylt.  There
-   are multiple config file locations that we need to read from,
-   and various default values that must be set if not present in
-   the config files.
+def prefixedNames (sorted_names, prefix):
+   """Returns every name in the sorted list SORTED_NAMES that starts
+   with PREFIX.
    """
 
-   config_file_list = [
+   start = bisect.bisect_left (sorted_names, prefix)
+   end = bisect.bisect_left (sorted_names, prefix + "\xff")
+   return sorted_names[start:end]
+
+def rankTitles (table, order, candidates, query, count):
+   """Returns the best COUNT of the keys of the title TABLE in
+   CANDIDATES for QUERY, which are every key that matches it (see
+   fuzzyRegexp), in ORDER (a mapping of every key to its place in the
+   order).  Keys whose titles start with the query come first, then
+   those with a word in the title starting with it, those with it
+   anywhere in the title, those with it anywhere in the name, and
+   finally the rest; within each of these, the keys stay in ORDER.
+   Each group is only looked for if the better ones didn't fill the
+   list, and only until it fills it.
+
+   This runs on every key typed into findPage, over nearly every page
+   while the query is short, so it has to stay well within a frame.
+   The first two groups are looked up in the table (see
+   buildTitleTable) rather than found by looking at every candidate,
+   and the others are only looked for until the list is full.
+   """
+
+   ranked = []
+   seen = set ()
+   groups = [
+      prefixedNames (table["sorted"], query),
+      map (table["word_keys"].__getitem__,
+       prefixedNames (table["words"], query))
+   ]
+   for keys in groups:
+      for key in heapq.nsmallest (count, set (keys) - seen,
+       key = order.__getitem__):
+         ranked.append (key)
+         seen.add (key)
+         if len (ranked) == count:
+            return ranked
+
+   query = re.escape (query)
+   groups = [
+      re.compile (query + "[^\t]*\t").search,
+      re.compile (query).search
+   ]
+   for test in groups:
+      for key in itertools.ifilter (test, candidates):
+         if key not in seen:
+            ranked.append (key)
+            seen.add (key)
+            if len (ranked) == count:
+               return ranked
+   for key in candidates:
+      if key not in seen:
+         ranked.append (key)
+         if len (ranked) == count:
+            break
+   return ranked
+
+def loadVisits (core_state):
+   """Returns how many times each page of the current collection has been
+   visited, loading the counts the first time they're needed.  They are
+   kept by name, in the same form as the filename index's "names", and
+   by user, next to the user's session (see sessionFilename); one
+   user's browsing shouldn't change how another's pages are ranked.
+   """
+
+   if None == core_state.visits:
+      visits = loadCacheFile (sessionFilename (core_state.root, "visits"))
+      if None == visits:
+         visits = {"counts": {}}
+      visits["dirty"] = False
+      core_state.visits = visits
+   return core_state.visits
+
+def noteVisit (core_state, filename):
+   """Counts a visit to a page, for findPage to rank it by.
+   """
+
+   visits = loadVisits (core_state)
+   name = "./" + os.path.normpath (filename)
+   visits["counts"][name] = visits["counts"].get (name, 0) + 1
+   visits["dirty"] = True
+
+def findPage (screen, bottom, core_state):
+   """Displays a 'find' prompt on the bottom line and, on SCREEN, a list
+   of the pages whose titles or names contain what has been typed so
+   far, in order; it is updated with every key.  Up and Down move
+   through the list, Enter returns the name of the page picked, and
+   Escape returns None.
+
+   The pages come from the filename index; the table of their titles
+   is built once and kept until the index changes.  Every key typed
+   onto the end of the query only has to look again at the pages the
+   shorter query matched.
+   """
+
+   screen.keypad (1)
+   if None == core_state.filename_index:
+      core_state.filename_index = loadFilenameIndex (core_state.root)
+   filename_index = core_state.filename_index
+   refreshFilenameIndex (core_state.root, filename_index)
+   table = core_state.title_table
+   if None == table or table["names"] is not filename_index["names"]:
+      table = core_state.title_table = buildTitleTable (
+       filename_index["names"])
+   everything = orderTitleTable (table, loadVisits (core_state)["counts"])
+   order = dict (itertools.izip (everything, itertools.count ()))
+
+   rows = core_state.y - 2
+   width = core_state.x - 1
+   prompt = "Find: "
+   query = ""
+   matched_query = ""
+   candidates = everything
+   selected = 0
+   while True:
+
+      # Narrow down the candidates if the query got longer, and start
+      # again from every page if it didn't.
+      if query != matched_query:
+         if not query.startswith (matched_query):
+            candidates = everything
+         if "" != query:
+            if 1 == len (query):
+               candidates = [key for key in candidates if query in key]
+            else:
+               candidates = filter (fuzzyRegexp (query).match, candidates)
+         matched_query = query
+         selected = 0
+      if "" != query:
+         ranked = rankTitles (table, order, candidates, query, rows)
+      else:
+         ranked = candidates[:rows]
+
+      screen.clear ()
+      for row, key in enumerate (ranked):
+         name = table["pages"][key]
+         line = generateTitle (name) + "  (" + name[2:] + ")"
+         if row == selected:
+            attribute = curses.A_REVERSE
+         else:
+            attribute = curses.A_NORMAL
+         screen.addnstr (row, 0, line, width, attribute)
+      screen.noutrefresh ()
+      displayNote (bottom, "%s%s  [%d of %d]" % (prompt, query,
+       len (candidates), len (everything)), width)
+      curses.doupdate ()
+
+      keypress = screen.getch ()
+      if 10 == keypress or curses.KEY_ENTER == keypress:
+         if ranked:
+            return table["pages"][ranked[selected]]
+         return None
+      elif 27 == keypress:
+         return None
+      elif curses.KEY_UP == keypress:
+         selected = max (0, selected - 1)
+      elif curses.KEY_DOWN == keypress:
+         selected = min (len (ranked) - 1, selected + 1)
+      elif (curses.KEY_BACKSPACE == keypress or 127 == keypress or
+       8 == keypress):
+         query = query[:-1]
+      elif 32 <= keypress < 127:
+         query += chr (keypress).lower ()
+
+def configurationFiles (root = "."):
+   """Returns the list of configuration files for the collection at ROOT,
+   in the order they are read; later ones override earlier ones.
+   """
+
+   return [
       SITE_CONFIG_FILE,
       os.path.expanduser ("~/.hylt.conf"),
-      "hylt.conf"
+      os.path.abspath (os.path.join (root, "hylt.conf"))
    ]
 
+# configuration_cache: The configuration loadConfiguration generated last
+# for every collection root, and the modification times of the
+# configuration files it was generated from, as (mtimes, configuration).
+
+configuration_cache = {}
+
+def loadConfiguration (root = ".", reload = False):
+   """Returns the configuration for the collection at ROOT, generating it
+   only if it hasn't been generated before or if any of the
+   configuration files have changed (or appeared or disappeared) since
+   it was.  RELOAD forces it to be generated again anyway.
+   """
+
+   mtimes = []
+   for config_file in configurationFiles (root):
+      try:
+         mtimes.append ((config_file, os.path.getmtime (config_file)))
+      except OSError:
+         mtimes.append ((config_file, None))
+   cached = configuration_cache.get (root)
+   if reload or None == cached or mtimes != cached[0]:
+      cached = configuration_cache[root] = (mtimes,
+       generateConfiguration (root))
+   return cached[1]
+
+def generateConfiguration (root = "."):
+   """Generate a configuration for a given instance of Hylt, viewing the
+   collection at ROOT.  There are multiple config file locations that
+   we need to read from, and various default values that must be set
+   if not present in the config files.  The configuration is returned
+   as a Configuration.
+   """
+
+   config_file_list = configurationFiles (root)
+
+   import ConfigParser
    config_parser = ConfigParser.ConfigParser ()
    config_parser.read (config_file_list)
 
@@ -610,7 +3878,8 @@ def generateConfiguration ():
             real_config[sect][opt] = opt_value
 
    # Done generating the configuration!  Return it.
-   return real_config
+   return Configuration (**dict ([(sect, CONFIG_SECTION_TYPES[sect] (**opts))
+    for sect, opts in real_config.items ()]))
 
 def historyCut (core_state):
    """ Remove all forward history (from current position)
@@ -618,27 +3887,22 @@ def historyCut (core_state):
 
    # We have to remove everything past the history_position, as
    # selecting a link kills history.
-   #
-   #   len (history) = history_postion - 1
-   #
-   # which makes the slice just [:].  Very clever.
-   core_state["history"] = core_state["history"][:core_state["history_position"] + 1]
-   return len (core_state["history"])
+   core_state.history.truncate (core_state.history_position + 1)
+   return len (core_state.history)
 
 def historyAdd (core_state, filename):
    """Add a page to the history. It's new file so there is no knowledge
-   of locations on the page, etc.
+   of locations on the page, etc.  If the history is full, the oldest
+   page in it is forgotten, unless that's the page being viewed, in
+   which case the new page isn't added at all.
    """
 
-   # Populate the history object and append it to the history stream.
-   history_dict = {
-      "filename": filename,
-      "cx": 0,
-      "cy": 0,
-      "selected_link": 0
-   }
-   core_state["history"].append (history_dict)
-   return len (core_state["history"])
+   history = core_state.history
+   if len (history) == history.limit and 0 == core_state.history_position:
+      return len (history)
+   if history.append (Location (filename)):
+      core_state.history_position -= 1
+   return len (history)
 
 def historyMove (core_state, step):
    """ Load a page from the forward (positive step) or backward (negative
@@ -646,16 +3910,31 @@ def historyMove (core_state, step):
    and 0 otherwise.
    """
 
-   old_pos = core_state["history_position"]
-   core_state["history_position"] = max (0, min (old_pos + step, 
-    len (core_state["history"]) - 1))
-   if (core_state["history_position"] != old_pos and
-    core_state["history_position"] >= 0):
-      return core_state["history_position"] - old_pos
+   old_pos = core_state.history_position
+   new_pos = max (0, min (old_pos + step, len (core_state.history) - 1))
+   if new_pos != old_pos and new_pos >= 0:
+
+      # Remember where we were on the page we're leaving.
+      if None != core_state.location:
+         core_state.history.put (old_pos, core_state.location)
+         core_state.location = None
+      core_state.history_position = new_pos
+      return new_pos - old_pos
    else:
       return 0
 
 
+def editableName (core_state, filename):
+   """Returns the name of the file to hand the editor to edit the page
+   FILENAME of the viewer's collection: the file the page is stored in,
+   even if it's compressed (editors that can't read those are better off
+   failing than making an uncompressed copy that hides it), or where a
+   new page would go.
+   """
+
+   full_name = os.path.join (core_state.root, filename)
+   return pageStorage (full_name) or full_name
+
 def invokeEditor (editor, filename):
    """Invoke an editor via spawnlp.
    """
@@ -681,29 +3960,162 @@ def convertFilenameToHylt (filename):
    """Converts a filename to a potential Hylt filename.
    """
 
+   # A compressed page is named like any other.
+   potential_filename = filename
+   for suffix in COMPRESSED_PAGE_SUFFIXES:
+      if potential_filename.endswith (".hylt" + suffix):
+         potential_filename = potential_filename[:-len (suffix)]
+
    # Add /Start.hylt at the end if the last five characters aren't .hylt.
-   potential_filename = args[0]
    if (len (potential_filename) < 5) or (".hylt" != potential_filename[-5:]):
       potential_filename += "/Start.hylt"
 
    return (os.path.normpath (potential_filename))
 
-def hyltMain (meta_screen, starting_filename):
+def closeViewer (core_state):
+   """Stops everything the viewer has running in the background and saves
+   what its indexes learned.  Returns the Prefetcher's stats.
+   """
+
+   stopWarmingPageCache (core_state)
+   stopSearch (core_state)
+   prefetch_stats = core_state.prefetcher.stop ()
+   saveIndexes (core_state)
+   return prefetch_stats
+
+def leaveViewer (core_state):
+   """Stops what the viewer is doing in the background for the page it is
+   on, when another viewer is about to be shown instead.
+   """
+
+   stopSearch (core_state)
+   core_state.prefetcher.cancel ()
+
+class Workspace (object):
+   """The collections the viewer has open, each shown by a Viewer kept by
+   the absolute path of the collection's root, all of them sharing one
+   PageCache (and so one memory limit) and one DirectoryCache.  A
+   collection keeps its page list, where it was and the indexes it has
+   loaded while another is being viewed, so going back to it costs
+   nothing.  Every viewer's pages are named relative to its own root
+   and checked by safePath against it, so each collection is a sandbox
+   of its own.
+
+   collections holds the collections that 'c' goes through, in order,
+   as a mapping of root to (starting filename, RESTORE_SESSION) for
+   open; they are only opened when they are first gone to.
+   """
+
+   __slots__ = ("y", "x", "page_cache", "dir_cache", "viewers", "sessions",
+    "collections")
+
+   def __init__ (self, y = 24, x = 80):
+      self.y = y
+      self.x = x
+      self.page_cache = PageCache ()
+      self.dir_cache = DirectoryCache ()
+      self.viewers = {}
+      self.sessions = set ()
+      self.collections = collections.OrderedDict ()
+
+   def add (self, starting_filename, restore_session = None):
+      """Adds the collection STARTING_FILENAME is in to the ones 'c' goes
+      through, to be opened with open (STARTING_FILENAME,
+      RESTORE_SESSION) when it is first gone to.  Returns False, adding
+      nothing, if there is no such page.
+      """
+
+      starting_filename = os.path.abspath (starting_filename)
+      if None == pageStorage (starting_filename):
+         return False
+      root = os.path.dirname (starting_filename)
+      if not root in self.collections:
+         self.collections[root] = (starting_filename, restore_session)
+      return True
+
+   def following (self, root):
+      """Returns the starting filename and RESTORE_SESSION of the
+      collection 'c' goes to from the one at ROOT, or None if there are
+      no others.
+      """
+
+      roots = self.collections.keys ()
+      if root in roots:
+         roots = roots[roots.index (root) + 1:] + roots[:roots.index (root)]
+      if 0 == len (roots):
+         return None
+      return self.collections[roots[0]]
+
+   def open (self, starting_filename, restore_session = None, config = None):
+      """Returns the Viewer of the collection STARTING_FILENAME is in, and
+      the manifest of the pages its last session had cached (see
+      restoreSession), or None.  A collection that is open already is
+      returned as it is, with no manifest.  Otherwise, the viewer starts
+      at STARTING_FILENAME, or if RESTORE_SESSION is True, wherever the
+      collection's last session left off, and if RESTORE_SESSION isn't
+      None, its session is saved when the workspace is closed.  CONFIG
+      is the configuration to use; by default, the collection's own is
+      loaded.
+      """
+
+      starting_filename = os.path.abspath (starting_filename)
+      root = os.path.dirname (starting_filename)
+      core_state = self.viewers.get (root)
+      if None != core_state:
+         return (core_state, None)
+
+      if None == config:
+         config = loadConfiguration (root)
+      core_state = Viewer (self.y, self.x, config, root, self.page_cache,
+       self.dir_cache)
+      core_state.history = History (config.pyui.history_limit)
+      core_state.prefetcher = Prefetcher (self.page_cache, root)
+      manifest = None
+      if restore_session:
+         manifest = restoreSession (core_state)
+      if None == manifest:
+         historyAdd (core_state, os.path.basename (starting_filename))
+         core_state.history_position = 0
+      if None != restore_session:
+         self.sessions.add (root)
+      self.viewers[root] = core_state
+      return (core_state, manifest)
+
+   def close (self):
+      """Closes every open collection (see closeViewer), saving the
+      sessions of those that keep one.  Returns the stats of all of
+      their Prefetchers, added up.
+      """
+
+      prefetch_stats = {}
+      for root, core_state in self.viewers.items ():
+         for stat, count in closeViewer (core_state).items ():
+            prefetch_stats[stat] = prefetch_stats.get (stat, 0) + count
+         if root in self.sessions:
+            saveSession (core_state)
+      self.viewers = {}
+      return prefetch_stats
+
+def hyltMain (meta_screen, starting_filename, restore_session = None,
+ config = None, more_collections = ()):
    """The core Hylt functionality.  Contains the main input and
-   display loops, lots of initialization, and so on.
+   display loops, lots of initialization, and so on.  CONFIG is the
+   configuration to use; by default, it is loaded (see
+   loadConfiguration).
+
+   If RESTORE_SESSION is None, the viewer doesn't keep a session at
+   all; otherwise it saves its session when it quits, and if it is
+   True, it starts by restoring the last one instead of at the
+   starting page.  MORE_COLLECTIONS are (starting filename,
+   RESTORE_SESSION) pairs for the other collections 'c' goes through,
+   along with those in the configuration.  Returns the Prefetchers'
+   stats.
    """
 
    curses.curs_set(0)
 
    # Remember: Parameters are in the order of (y, x).
    meta_y, meta_x = meta_screen.getmaxyx()
-   core_state = {"y": meta_y, "x": meta_x}
-
-   # Change to the base path.
-   if "" != os.path.dirname (starting_filename):
-      os.chdir (os.path.dirname (starting_filename))
-   core_state["curr_base_path"] = ""
-   
 
    # There are three windows: a top status bar, a primary screen, and a bottom
    # status bar.  There is also the main screen, of course.  Create them.
@@ -711,20 +4123,42 @@ def hyltMain (meta_screen, starting_filename):
    main = meta_screen.subwin (meta_y - 2, meta_x, 1, 0)
    bottom = meta_screen.subwin (1, meta_x, meta_y - 1, 0)
 
-   # Read in the configuration.
-   config = core_state["config"] = generateConfiguration ()
-
-   editor = config["pyui"]["editor"]
-
-   # Okay.  History's actually a bad name for this right now, but it'll have
-   # to do.  This is a list of pages; it normally tracks history, but can
-   # also track search results.  At the beginning, the only element in the
-   # history is the starting page; others will be added, subtracted, etc.
-   core_state["history"] = []
-   historyAdd(core_state, os.path.basename (starting_filename))
-   core_state["history_position"] = 0
+   # Every collection is viewed by a Viewer of its own, kept in the
+   # workspace; every page is named relative to its collection's root,
+   # and the current directory is left alone.  Okay.  History's actually
+   # a bad name for this right now, but it'll have to do.  Each viewer has
+   # a list of pages; it normally tracks history, but can also track
+   # search results.  At the beginning, the only element in the history is
+   # the starting page; others will be added, subtracted, etc.
+   workspace = Workspace (meta_y, meta_x)
+   workspace.add (starting_filename, restore_session)
+   core_state, manifest = workspace.open (starting_filename,
+    restore_session, config)
+   for filename, more_restore_session in more_collections:
+      workspace.add (filename, more_restore_session)
+   if None != restore_session:
+      more_restore_session = True
+   else:
+      more_restore_session = None
+   missing_collections = []
+   for filename in core_state.config.pyui.collections.split (os.pathsep):
+      if "" != filename.strip ():
+         full_name = os.path.join (core_state.root, filename.strip ())
+         if not workspace.add (convertFilenameToHylt (full_name),
+          more_restore_session):
+            missing_collections.append (filename.strip ())
+   prefetch_targets = []
+
+   # The documentation and the keyboard reference are collections of
+   # their own too, so going to one and back only switches viewers.
+   # previous_viewers are the viewers to go back to, most recent last.
+   previous_viewers = []
 
    fresh_page = True
+   missing_note = None
+   if missing_collections:
+      missing_note = ("No such collection: " +
+       ", ".join (missing_collections) + ".")
    done = False
 
    curses.def_prog_mode ()
@@ -732,68 +4166,143 @@ def hyltMain (meta_screen, starting_filename):
    main_needs_redraw = True
 
    while not done:
-      current_loc = core_state["history"][core_state["history_position"]]
-      if fresh_page:
-
-         filename = current_loc["filename"]
-         core_state["curr_base_path"] = os.path.dirname (filename)
+      if None != core_state.search:
+         if collectSearchResults (core_state):
+            fresh_page = True
 
-         readHyltFile (filename, core_state) 
-#        debugPrintPage (core_state["data_array"])
+      current_loc = core_state.currentLocation ()
+      if fresh_page:
 
-         core_state["title"] = generateTitle (filename)
+         filename = current_loc.filename
+         try:
+            loadPage (core_state, filename)
+         except (IOError, OSError):
+
+            # The page has been renamed or removed since it went into
+            # the history (often in an earlier session).  Drop it and
+            # go to the page before it, which is the page we came from
+            # if we were going forward, and the next one back if we
+            # were going back.  A history of nothing but the missing
+            # page leaves us nowhere to go, though.
+            if len (core_state.history) <= 1:
+               raise
+            core_state.history.remove (core_state.history_position)
+            core_state.history_position = max (0,
+             core_state.history_position - 1)
+            core_state.location = None
+            missing_note = "'" + filename + "' no longer exists."
+            continue
+#        debugPrintPage (core_state.page.data_array)
+
+         # Reloading a page isn't another visit to it.
+         if current_loc is not core_state.visited:
+            noteVisit (core_state, filename)
+            core_state.visited = current_loc
 
          # Links can be removed between page loads, and the history
          # jumper defaults to link 0, which doesn't exist on a page
          # with no links.  In either case, we're safe if we just
          # change the link count to something more appropriate.
-         current_loc["selected_link"] = min(current_loc["selected_link"], core_state["link_count"] - 1)
-         if current_loc["selected_link"] == -1:
-            current_loc["selected_link"] = None
+         current_loc.selected_link = min(current_loc.selected_link, core_state.page.link_count - 1)
+         if current_loc.selected_link == -1:
+            current_loc.selected_link = None
      
          dir_delta = 1
          fresh_page = False
          main_needs_redraw = True
          displayHeader (top, core_state)
          displayLinkInfo (bottom, core_state)
+         if None != missing_note:
+            displayNote (bottom, missing_note, core_state.x - 1)
+            missing_note = None
 
       fixCursorCoords (core_state)
       if main_needs_redraw:
          displayPage (main, core_state)
+         main_needs_redraw = False
+
+      search = core_state.search
+      if None != search:
+         displayNote (bottom, describeSearch (search), core_state.x - 1)
+         if search["done"]:
+            stopSearch (core_state)
       curses.doupdate ()
+
+      # Only once the restored page is up, start reading the rest of
+      # the pages the last session had cached.
+      if manifest:
+         startWarmingPageCache (core_state, manifest)
+         manifest = None
+
+      # Start reading the page the selected link leads to, and the next
+      # few pages of the page list, so that they're there already if we
+      # go to them.
+      targets = readAheadTargets (core_state)
+      if targets != prefetch_targets:
+         prefetch_targets = targets
+         core_state.prefetcher.prefetch (targets)
+
+      # While a search is running in the background, don't wait for a
+      # key forever; come back around every so often to show what it
+      # has found.  Any key stops the search, and then does what it
+      # usually does.
+      if None != core_state.search:
+         meta_screen.timeout (SEARCH_POLL_DELAY)
+      else:
+         meta_screen.timeout (-1)
       keypress = meta_screen.getch()
+      if -1 == keypress:
+         continue
+      if None != search and None != core_state.search:
+         if stopSearch (core_state):
+            fresh_page = True
+         displayNote (bottom, describeSearch (search), core_state.x - 1)
+
       if ord ('q') == keypress:
-         done = True
+         if previous_viewers:
+            leaveViewer (core_state)
+            core_state = previous_viewers.pop ()
+            prefetch_targets = []
+            fresh_page = True
+         else:
+            done = True
       elif ord ('h') == keypress:
-         current_loc["cx"] -= min (max (1, meta_x / 2), 8)
+         current_loc.cx -= min (max (1, meta_x / 2), 8)
          main_needs_redraw = True
       elif ord ('j') == keypress:
-         current_loc["cy"] += min (max (1, meta_x / 2), 8)
+         current_loc.cy += min (max (1, meta_x / 2), 8)
          main_needs_redraw = True
       elif ord ('k') == keypress:
-         current_loc["cy"] -= min (max (1, meta_x / 2), 8)
+         current_loc.cy -= min (max (1, meta_x / 2), 8)
          main_needs_redraw = True
       elif ord ('l') == keypress:
-         current_loc["cx"] += min (max (1, meta_x / 2), 8)
+         current_loc.cx += min (max (1, meta_x / 2), 8)
          main_needs_redraw = True
       elif ord ('x') == keypress:
-         exportToHTML (filename[:-4] + "html",
-          core_state["data_array"], core_state["link_list"])
+         exportToHTML (os.path.join (core_state.root,
+          filename[:-4] + "html"), core_state.page.data_array,
+          core_state.page.link_list)
          displayNote (bottom, "Exported to '" + filename[:-4]
-          + "html' ...", core_state["x"])
+          + "html' ...", core_state.x)
       elif curses.KEY_NPAGE == keypress:
-         current_loc["cy"] += meta_y - 4
+         current_loc.cy += meta_y - 4
          main_needs_redraw = True
       elif curses.KEY_PPAGE == keypress:
-         current_loc["cy"] -= meta_y - 4
+         current_loc.cy -= meta_y - 4
          main_needs_redraw = True
       elif ord ('[') == keypress:
-         current_loc["cx"] -= meta_x - 4
+         current_loc.cx -= meta_x - 4
          main_needs_redraw = True
       elif ord (']') == keypress:
-         current_loc["cx"] += meta_x - 4
+         current_loc.cx += meta_x - 4
          main_needs_redraw = True
+      elif ord ('R') == keypress:
+         core_state.config = loadConfiguration (core_state.root, True)
+         displayNote (bottom, "Configuration reloaded.", core_state.x - 1)
+
       elif ord ('r') == keypress:
+         core_state.page_cache.discard (os.path.join (core_state.root,
+          os.path.normpath (filename)))
          fresh_page = True
 
       # Extended regular expression based pathname matching, working directory
@@ -801,15 +4310,36 @@ def hyltMain (meta_screen, starting_filename):
       # history list creating 'go' feature (note: full room service is not
       # included in trial version)
       elif ord ('g') == keypress:
-         result = smartGo(bottom, core_state)
-         if len(result):
+         startSearch (core_state, smartGo (bottom, core_state))
+
+      elif ord ('/') == keypress:
+         searchInPage (main, bottom, core_state)
+         main_needs_redraw = True
+         displayLinkInfo (bottom, core_state)
+
+      elif (ord ('n') == keypress or ord ('N') == keypress) and (
+       None != core_state.page_search):
+         if ord ('n') == keypress:
+            direction = 1
+         else:
+            direction = -1
+         displayNote (bottom, jumpToPageMatch (core_state, direction),
+          core_state.x - 1)
+         main_needs_redraw = True
+
+      elif ord ('b') == keypress:
+         startSearch (core_state, BACKLINK_SEARCH_PREFIX + filename)
+
+      elif ord ('f') == keypress:
+         found = findPage (main, bottom, core_state)
+         if None != found:
             historyCut (core_state)
-            for page in result:
-               historyAdd (core_state, page)
+            historyAdd (core_state, found)
             historyMove (core_state, 1)
             fresh_page = True
          else:
-            displayNote(bottom, "No matching files found", core_state["x"] - 1)
+            main_needs_redraw = True
+            displayLinkInfo (bottom, core_state)
          
       elif (curses.KEY_LEFT == keypress or curses.KEY_BACKSPACE == keypress or
        ord (',') == keypress):
@@ -821,8 +4351,10 @@ def hyltMain (meta_screen, starting_filename):
             fresh_page = True
 
       elif ord ('e') == keypress:
-         if config["collection"]["editable"]:
-            invokeEditor (editor, filename)
+         if core_state.config.collection.editable:
+            invokeEditor (core_state.config.pyui.editor,
+             editableName (core_state, filename))
+            noteEditedPage (core_state, filename)
 
             curses.reset_prog_mode ()
             curses.curs_set(1)
@@ -830,36 +4362,72 @@ def hyltMain (meta_screen, starting_filename):
             fresh_page = True
             curr_loc_info = None
 
-      elif ord ('d') == keypress:
-         if os.path.isfile (config["pyui"]["documentation_root"]):
-            current_directory = os.getcwd ()
-            hyltMain (meta_screen,config["pyui"]["documentation_root"])
-            os.chdir (current_directory)
-         
-      elif ord ('?') == keypress:
-         if os.path.isfile (config["pyui"]["keyboard_reference"]):
-            current_directory = os.getcwd ()
-            hyltMain (meta_screen,config["pyui"]["keyboard_reference"])
-            os.chdir (current_directory)
+      elif ord ('d') == keypress or ord ('?') == keypress:
+         if ord ('d') == keypress:
+            doc_filename = core_state.config.pyui.documentation_root
+         else:
+            doc_filename = core_state.config.pyui.keyboard_reference
+
+         # Relative names are relative to the collection being viewed.
+         doc_filename = os.path.join (core_state.root, doc_filename)
+         if None != pageStorage (doc_filename):
+            doc_viewer = workspace.open (doc_filename,
+             config = core_state.config)[0]
+
+            # Going to a viewer we'd go back to anyway is going back to it.
+            if doc_viewer in previous_viewers:
+               del previous_viewers[previous_viewers.index (doc_viewer):]
+            elif doc_viewer is not core_state:
+               previous_viewers.append (core_state)
+            if doc_viewer is not core_state:
+               leaveViewer (core_state)
+               core_state = doc_viewer
+               prefetch_targets = []
+               fresh_page = True
+
+            # Both of them may be in the same collection, so the viewer
+            # may have to go to the page asked for.
+            doc_filename = os.path.basename (doc_filename)
+            if core_state.currentLocation ().filename != doc_filename:
+               historyCut (core_state)
+               historyAdd (core_state, doc_filename)
+               historyMove (core_state, 1)
+               fresh_page = True
+
+      elif ord ('c') == keypress:
+         following = workspace.following (core_state.root)
+
+         # The collection may have gone away (been unmounted, say) since
+         # it was added; if so, it's dropped, and the next 'c' goes on.
+         if None != following and None == pageStorage (following[0]):
+            del workspace.collections[os.path.dirname (following[0])]
+            displayNote (bottom, "'" + following[0] + "' no longer exists.",
+             core_state.x - 1)
+         elif None != following:
+            leaveViewer (core_state)
+            core_state, manifest = workspace.open (*following)
+            previous_viewers = []
+            prefetch_targets = []
+            fresh_page = True
 
       # Don't even bother with link actions if there are no links.
-      elif core_state["link_count"] > 0:
+      elif core_state.page.link_count > 0:
          if curses.KEY_UP == keypress:
-            if current_loc["selected_link"] == 0:
-               current_loc["cy"] -= min (max (1, meta_x / 2), 8)
+            if current_loc.selected_link == 0:
+               current_loc.cy -= min (max (1, meta_x / 2), 8)
                dir_delta = -1
             else:
-               current_loc["selected_link"] -= 1
+               current_loc.selected_link -= 1
                moveCursorForLink (core_state, -1)
                displayLinkInfo (bottom, core_state)
             main_needs_redraw = True
 
          elif curses.KEY_DOWN == keypress:
-            if current_loc["selected_link"] == core_state["link_count"] - 1:
-               current_loc["cy"] += min (max (1, meta_x / 2), 8)
+            if current_loc.selected_link == core_state.page.link_count - 1:
+               current_loc.cy += min (max (1, meta_x / 2), 8)
                dir_delta = -1
             else:
-               current_loc["selected_link"] += 1
+               current_loc.selected_link += 1
                moveCursorForLink (core_state, 1)
                displayLinkInfo (bottom, core_state)
             main_needs_redraw = True
@@ -869,11 +4437,13 @@ def hyltMain (meta_screen, starting_filename):
             main_needs_redraw = True
 
          elif ord ('E') == keypress:
-            if config["collection"]["editable"]:
-               dest = os.path.join (core_state["curr_base_path"],
-                core_state["link_list"][current_loc["selected_link"]])
+            if core_state.config.collection.editable:
+               dest = os.path.join (core_state.page.curr_base_path,
+                core_state.page.link_list[current_loc.selected_link])
 
-               invokeEditor (editor, dest)
+               invokeEditor (core_state.config.pyui.editor,
+                editableName (core_state, dest))
+               noteEditedPage (core_state, dest)
 
                curses.reset_prog_mode ()
                curses.curs_set(1)
@@ -887,10 +4457,10 @@ def hyltMain (meta_screen, starting_filename):
          
             # The big one--jump to a new Hylt page.  First, make sure it's a
             # real page.
-            rel_name = core_state["link_list"][current_loc["selected_link"]]
+            rel_name = core_state.page.link_list[current_loc.selected_link]
             real_path = os.path.normpath (os.path.join (
-             core_state["curr_base_path"], rel_name))
-            if os.path.isfile (real_path):
+             core_state.page.curr_base_path, rel_name))
+            if core_state.dir_cache.exists (core_state.root, real_path):
                historyCut (core_state)
                historyAdd (core_state, real_path)
                historyMove (core_state, 1)
@@ -898,31 +4468,356 @@ def hyltMain (meta_screen, starting_filename):
             else:
                displayNote (bottom, "|" + rel_name +
                 "| not found. Do you want to create this file? [y/N] ",
-                core_state["x"] - 1)
+                core_state.x - 1)
                response = bottom.getch (0, 0)
                if ord ('y') == response or ord ('Y') == response:
-                  invokeEditor (editor, real_path)
+                  invokeEditor (core_state.config.pyui.editor,
+                   editableName (core_state, real_path))
+                  noteEditedPage (core_state, real_path)
+                  main_needs_redraw = True
 
                   curses.reset_prog_mode ()
                   curses.curs_set(1)
                   curses.curs_set(0)
-               displayNote(bottom, real_path, core_state["x"] - 1)
+               displayNote(bottom, real_path, core_state.x - 1)
                
+   # Hang on to anything the indexes learned while we were running.
+   return workspace.close ()
 
-if "__main__" == __name__:
-   core_state = {}
-   option_parser = optparse.OptionParser ()
-   options, args = option_parser.parse_args ()
-   if len (args) == 1:
-      filename = convertFilenameToHylt (args[0])
-   elif len (args) == 0:
-      filename = "./Start.hylt"
+class HeadlessScreen (object):
+   """A curses window that draws nowhere, for running the viewer without
+   a terminal (see runHeadless).  Every key read from it is a q.
+   """
+
+   def __init__ (self, y = 24, x = 80):
+      self.y = y
+      self.x = x
+
+   def getmaxyx (self):
+      return (self.y, self.x)
+
+   def subwin (self, y, x, begin_y, begin_x):
+      return HeadlessScreen (y, x)
+
+   def getch (self):
+      return ord ("q")
+
+   def getstr (self):
+      return ""
+
+   def ignore (self, *args):
+      pass
+
+   addch = addnstr = attrset = clear = hline = ignore
+   keypad = noutrefresh = timeout = ignore
+
+class HeadlessCurses (object):
+   """Stands in for the curses module while the viewer runs on a
+   HeadlessScreen: the terminal calls do nothing, doupdate calls
+   ON_UPDATE instead, and everything else (the attribute and key
+   constants) comes from the real module.
+   """
+
+   def __init__ (self, module, on_update):
+      self.module = module
+      self.on_update = on_update
+
+   def __getattr__ (self, name):
+      return getattr (self.module, name)
+
+   def doupdate (self):
+      self.on_update ()
+
+   def ignore (self, *args):
+      pass
+
+   curs_set = def_prog_mode = echo = noecho = reset_prog_mode = ignore
+
+def runHeadless (starting_filename, restore_session = None,
+ on_update = None):
+   """Runs the viewer on a HeadlessScreen, calling ON_UPDATE every time
+   it would have updated the terminal, and returns what hyltMain does.
+   """
+
+   global curses
+   real_curses = curses
+   curses = HeadlessCurses (real_curses, on_update or (lambda: None))
+   try:
+      return hyltMain (HeadlessScreen (), starting_filename, restore_session)
+   finally:
+      curses = real_curses
+
+def reportFirstScreen ():
+   """The ON_UPDATE of a viewer being benchmarked: prints the time it
+   put up its first screen and exits at once, without saving anything.
+   """
+
+   sys.stdout.write ("%.6f\n" % time.time ())
+   sys.stdout.flush ()
+   os._exit (0)
+
+def benchmarkStartup (args, runs = STARTUP_RUNS):
+   """Starts the viewer with the command line arguments ARGS RUNS times,
+   each time in a new process running headless, and returns a sorted
+   list of how long, in milliseconds, each took from starting its
+   process to its first screen, or None if it didn't get that far.  One
+   more start than RUNS is made, and the first isn't counted; it only
+   warms the operating system's caches.
+   """
+
+   import subprocess
+   environment = dict (os.environ)
+   environment[STARTUP_VARIABLE] = "1"
+   command = [sys.executable, os.path.abspath (sys.argv[0])] + list (args)
+
+   times = []
+   for run in range (runs + 1):
+      start_time = time.time ()
+      child = subprocess.Popen (command, stdout = subprocess.PIPE,
+       env = environment)
+      output = child.communicate ()[0]
+      try:
+         times.append ((float (output) - start_time) * 1000)
+      except ValueError:
+         return None
+   return sorted (times[1:])
+
+def benchmarkReads (root, pages = READ_BENCHMARK_PAGES,
+ runs = READ_BENCHMARK_RUNS):
+   """Copies up to PAGES pages of the collection at ROOT into a scratch
+   directory once for each way a page can be stored (uncompressed, then
+   one for each of COMPRESSED_PAGE_SUFFIXES that can be read here), and
+   times reading and parsing all of them, bypassing the page cache.
+   Returns a tuple of (number of pages copied, list of (storage, bytes on
+   disk, seconds) for each way), the seconds being the best of RUNS
+   runs.
+   """
+
+   import gzip
+   import shutil
+   import tempfile
+
+   sample = []
+   for dir_name, dir_pages, subdirs in walkCollection (root, sort = True):
+      sample.extend (dir_pages[:pages - len (sample)])
+      if len (sample) >= pages:
+         break
+
+   writers = [("", None), (".gz", gzip.open)]
+   lzma = importLzma ()
+   if None != lzma:
+      writers.append ((".xz", lzma.LZMAFile))
+
+   scratch = tempfile.mkdtemp (prefix = "hylt-reads-")
+   results = []
+   try:
+      for suffix, writer in writers:
+         copy_root = os.path.join (scratch, suffix.lstrip (".") or "plain")
+         size = 0
+         for filename in sample:
+            target = os.path.join (copy_root, filename) + suffix
+            if not os.path.isdir (os.path.dirname (target)):
+               os.makedirs (os.path.dirname (target))
+            source_file = openPage (os.path.join (root, filename))
+            try:
+               if None == writer:
+                  target_file = open (target, "wb")
+               else:
+                  target_file = writer (target, "wb")
+               try:
+                  shutil.copyfileobj (source_file, target_file)
+               finally:
+                  target_file.close ()
+            finally:
+               source_file.close ()
+            size += os.path.getsize (target)
+
+         best = None
+         for run in range (runs):
+            start_time = time.time ()
+            for filename in sample:
+               parsePage (copy_root, filename)
+            elapsed = time.time () - start_time
+            if None == best or elapsed < best:
+               best = elapsed
+         results.append ((suffix or "uncompressed", size, best))
+   finally:
+      shutil.rmtree (scratch, ignore_errors = True)
+   return (len (sample), results)
+
+def main ():
+   """Runs hylt.py as the command line asks: one of the batch modes, or
+   the viewer.
+   """
+
+   if [arg for arg in sys.argv[1:] if arg.startswith ("-")]:
+      import optparse
+      option_parser = optparse.OptionParser (
+       usage = "%prog [options] [dir-or-file ...]")
+      option_parser.add_option ("-x", "--export", action = "store_true",
+       help = "export the whole collection to XHTML and exit")
+      option_parser.add_option ("-w", "--watch", action = "store_true",
+       help = "export the collection, then keep re-exporting "
+       "pages as they change")
+      option_parser.add_option ("-f", "--force", action = "store_true",
+       help = "export pages even if their XHTML is current")
+      option_parser.add_option ("-z", "--gzip", action = "store_true",
+       help = "also write gzipped .html.gz copies of the XHTML")
+      option_parser.add_option ("-s", "--search-index", action = "store_true",
+       help = "also write a static search index and page into "
+       + SEARCH_INDEX_DIR)
+      option_parser.add_option ("--graph-json", metavar = "FILE",
+       help = "write the collection's link graph to FILE as JSON and exit")
+      option_parser.add_option ("--graph-dot", metavar = "FILE",
+       help = "write the collection's link graph to FILE in Graphviz DOT "
+       "format and exit")
+      option_parser.add_option ("--check-links", action = "store_true",
+       help = "report broken links, links escaping the "
+       "collection and pages unreachable from Start.hylt, and exit")
+      option_parser.add_option ("--serve", action = "store_true",
+       help = "serve the collection as XHTML over HTTP on "
+       "localhost")
+      option_parser.add_option ("-p", "--port", type = "int",
+       help = "port to serve the collection on [default: %default]")
+      option_parser.add_option ("--threads", type = "int",
+       help = "number of threads answering HTTP requests [default: %default]")
+      option_parser.add_option ("-j", "--jobs", type = "int",
+       help = "number of worker processes for --export, --watch and the "
+       "collection reports [default: one per CPU]")
+      option_parser.add_option ("--stats", action = "store_true",
+       help = "print how well reading pages ahead of time "
+       "worked when quitting the viewer")
+      option_parser.add_option ("--benchmark-startup", action = "store_true",
+       help = "time how long the viewer takes to put up its first screen, "
+       "against a target of %d ms, and exit" % STARTUP_TARGET)
+      option_parser.add_option ("--benchmark-reads", action = "store_true",
+       help = "time reading the collection's pages stored uncompressed "
+       "and compressed, and exit")
+      option_parser.add_option ("--interval", type = "float",
+       help = "seconds between watch polls [default: %default]")
+      option_parser.set_defaults (**DEFAULT_OPTIONS)
+      options, args = option_parser.parse_args ()
    else:
-      print "ERROR: You must pass either no parameters (which uses Start.hylt)"
-      print "or a single filename to use."
+      options = collections.namedtuple ("Options", DEFAULT_OPTIONS.keys ()) (
+       **DEFAULT_OPTIONS)
+      args = sys.argv[1:]
+   # Every name is a collection to view (the first is shown first); with
+   # none, the collection in the current directory is used.
+   if len (args) == 0:
+      args = ["."]
+   filenames = [convertFilenameToHylt (arg) for arg in args]
+   for filename in filenames:
+      if None == pageStorage (filename):
+         print "ERROR: %s does not exist." % (filename)
+         print "Please pass in a valid Hylt file or directory."
+         sys.exit (0)
+   filename = filenames[0]
+
+   # The batch modes work on the whole collection the first page is in.
+   root = os.path.dirname (filename) or "."
+
+   if options.graph_json or options.graph_dot:
+      start_time = time.time ()
+      graph = buildLinkGraph (root, createWorkerPool (options.jobs))
+      if options.graph_json:
+         graph_file = open (options.graph_json, "w")
+         writeLinkGraphJSON (graph_file, graph)
+         graph_file.close ()
+      if options.graph_dot:
+         graph_file = open (options.graph_dot, "w")
+         writeLinkGraphDOT (graph_file, graph)
+         graph_file.close ()
+      link_count = 0
+      missing_count = 0
+      for links in graph.values ():
+         link_count += len (links)
+         missing_count += len ([link for link in links if link[2]])
+      print ("Wrote the link graph of %d pages: %d links, %d to missing "
+       "pages (%.2fs)." % (len (graph), link_count, missing_count,
+       time.time () - start_time))
+      sys.exit (0)
+
+   if options.check_links:
+      start_time = time.time ()
+      report = checkCollectionLinks (root,
+       pool = createWorkerPool (options.jobs))
+      problems = writeLinkReport (sys.stdout, report)
+      print "(%.2fs)" % (time.time () - start_time)
+      sys.exit (min (problems, 1))
+
+   if options.serve:
+      try:
+         serveCollection (root, options.port, options.threads)
+      except KeyboardInterrupt:
+         pass
+      sys.exit (0)
+
+   if options.export or options.watch:
+      pool = createWorkerPool (options.jobs)
+      if options.watch:
+         def printSummary (stats):
+            print time.strftime ("[%H:%M:%S]"), formatExportSummary (stats)
+            sys.stdout.flush ()
+         try:
+            watchCollection (root, interval = options.interval,
+             compress = options.gzip, index = options.search_index,
+             pool = pool, report = printSummary)
+         except KeyboardInterrupt:
+            pass
+      else:
+         if options.search_index:
+            page_terms = {}
+         else:
+            page_terms = None
+         print formatExportSummary (exportCollection (root,
+          force = options.force, compress = options.gzip,
+          page_terms = page_terms, pool = pool))
       sys.exit (0)
-   if not os.path.isfile (filename):
-      print "ERROR: %s does not exist." % (filename)
-      print "Please pass in a valid Hylt file or directory."
+
+   if options.benchmark_startup:
+      times = benchmarkStartup (args)
+      if None == times:
+         print "ERROR: The viewer didn't start."
+         sys.exit (1)
+      median = times[len (times) // 2]
+      print ("First screen in %.1f ms (median of %d starts; %.1f to %.1f "
+       "ms); the target is %d ms." % (median, len (times), times[0],
+       times[-1], STARTUP_TARGET))
+      if "__main__" == __name__:
+         print ("(Started through hylt.py, which Python compiles every time; "
+          "the target is for the hylt launcher.)")
+      sys.exit (int (median > STARTUP_TARGET))
+
+   if options.benchmark_reads:
+      page_count, results = benchmarkReads (root)
+      if 0 == page_count:
+         print "ERROR: There are no pages to read."
+         sys.exit (1)
+      print ("Reading and parsing %d pages (best of %d runs; the slow disk "
+       "reads %.1f MiB/s):" % (page_count, READ_BENCHMARK_RUNS,
+       SLOW_DISK_BANDWIDTH / float (1 << 20)))
+      for storage, size, seconds in results:
+         print ("  %-12s %9d bytes  %6.3f ms/page  %6.3f ms/page on the "
+          "slow disk" % (storage, size, seconds * 1000 / page_count,
+          (seconds + size / float (SLOW_DISK_BANDWIDTH)) * 1000 / page_count))
+      if len (results) <= 2:
+         print "  (.xz pages can't be read here; there is no lzma module.)"
       sys.exit (0)
-   curses.wrapper (hyltMain, filename)
+
+   # Pick up where the last session of every collection left off, unless
+   # we were asked for a particular page.
+   page_suffixes = tuple ([".hylt"] + [".hylt" + suffix
+    for suffix in COMPRESSED_PAGE_SUFFIXES])
+   restore_sessions = [not arg.endswith (page_suffixes) for arg in args]
+   if os.getenv (STARTUP_VARIABLE):
+      runHeadless (filename, restore_sessions[0], reportFirstScreen)
+      sys.exit (1)
+   prefetch_stats = curses.wrapper (hyltMain, filename, restore_sessions[0],
+    None, zip (filenames[1:], restore_sessions[1:]))
+   if options.stats:
+      print ("Pages read ahead: %(requested)d asked for, %(read)d read, "
+       "%(cancelled)d cancelled, %(skipped)d skipped; %(hits)d used, %(wasted)d wasted." %
+       prefetch_stats)
+
+if "__main__" == __name__:
+   main ()
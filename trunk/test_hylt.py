@@ -0,0 +1,665 @@
+#!/usr/bin/env python
+
+# test_hylt.py - tests for hylt.py that don't need a terminal
+#
+# Copyright 2005 Phil Bordelon, Jochen Eisinger, Martin Ockajak, John Vernon.
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# (The license can be found in LICENSE.)
+
+# Run from this directory with:
+#
+#    python -m unittest test_hylt
+#
+# Every test builds a small collection of its own in a temporary directory,
+# and gets a temporary home directory as well, so nothing here needs a
+# terminal or touches any real collection or session; the few tests that
+# run the viewer itself do so on a ScriptedScreen.
+
+import marshal
+import os
+import pickle
+import shutil
+import tempfile
+import time
+import unittest
+
+import hylt
+
+class CollectionTestCase (unittest.TestCase):
+   """Gives every test a fresh, empty collection root, and helpers to
+   fill it in.  HOME is pointed at an empty directory of its own for
+   the length of the test, so that sessions and visit counts never
+   land in (or come from) the real one.
+   """
+
+   def setUp (self):
+      self.root = tempfile.mkdtemp (prefix = "hylt-test-")
+      self.home = tempfile.mkdtemp (prefix = "hylt-test-home-")
+      self.old_home = os.environ.get ("HOME")
+      os.environ["HOME"] = self.home
+
+   def tearDown (self):
+      if None == self.old_home:
+         del os.environ["HOME"]
+      else:
+         os.environ["HOME"] = self.old_home
+      shutil.rmtree (self.home)
+      shutil.rmtree (self.root)
+
+   def path (self, name):
+      return os.path.join (self.root, name)
+
+   def writePage (self, name, text):
+      """Writes the page NAME (relative to the root) with TEXT in it,
+      making its directory if need be.  The page and its directory are
+      given modification times well after any earlier ones, so that
+      changes are seen however coarse the filesystem's clock is.
+      """
+
+      full_name = self.path (name)
+      if not os.path.isdir (os.path.dirname (full_name)):
+         os.makedirs (os.path.dirname (full_name))
+      page_file = open (full_name, "w")
+      page_file.write (text)
+      page_file.close ()
+      self.touch (name)
+      self.touch (os.path.dirname (name))
+
+   def removePage (self, name):
+      os.remove (self.path (name))
+      self.touch (os.path.dirname (name))
+
+   def touch (self, name):
+      """Moves the modification time of NAME (relative to the root)
+      on by a few seconds from the latest one given out so far.
+      """
+
+      self.clock = max (getattr (self, "clock", 0), time.time ()) + 5
+      os.utime (self.path (name), (self.clock, self.clock))
+
+   def viewer (self, root = None):
+      return hylt.Viewer (root = root or self.root)
+
+   def readHTML (self, name):
+      html_file = open (hylt.htmlFilename (self.path (name)))
+      try:
+         return html_file.read ()
+      finally:
+         html_file.close ()
+
+class ScriptedScreen (hylt.HeadlessScreen):
+   """A HeadlessScreen that reads its keys from a list.  A key may also
+   be a function, which is called (to change the collection under the
+   viewer, say) before the next key is read.  Once the list runs out,
+   every key is a q.
+   """
+
+   def __init__ (self, keys, y = 24, x = 80):
+      hylt.HeadlessScreen.__init__ (self, y, x)
+      self.keys = list (keys)
+
+   def getch (self):
+      while self.keys:
+         key = self.keys.pop (0)
+         if callable (key):
+            key ()
+         else:
+            return ord (key)
+      return ord ("q")
+
+def runViewer (keys, starting_filename, restore_session = None,
+ more_collections = ()):
+   """Runs the viewer on a ScriptedScreen, without a terminal, as
+   runHeadless does.
+   """
+
+   real_curses = hylt.curses
+   hylt.curses = hylt.HeadlessCurses (real_curses, lambda: None)
+   try:
+      return hylt.hyltMain (ScriptedScreen (keys), starting_filename,
+       restore_session, more_collections = more_collections)
+   finally:
+      hylt.curses = real_curses
+
+class WatchTest (CollectionTestCase):
+
+   def testBatchesAndReexportsChanges (self):
+      self.writePage ("Start.hylt", "The start.  See [[Old]].\n")
+      self.writePage ("Old.hylt", "An old page.\n")
+
+      # should_stop is called once before every poll, which makes it a
+      # handy place to change the collection between polls.  A burst of
+      # saves (a new page, then an edit, then a deletion, all a poll
+      # apart) should be exported as a single batch once a poll comes
+      # back clean.
+      burst = [
+         lambda: self.writePage ("sub/New.hylt", "A new page.\n"),
+         lambda: self.writePage ("Start.hylt", "The start, edited.\n"),
+         lambda: self.removePage ("Old.hylt")
+      ]
+      polls = []
+      reports = []
+      def shouldStop ():
+         polls.append (len (reports))
+         if burst:
+            burst.pop (0) ()
+         return 2 == len (reports) or len (polls) > 50
+
+      hylt.watchCollection (self.root, interval = 0.01, max_interval = 0.02,
+       settle = 0.01, report = reports.append, should_stop = shouldStop)
+
+      self.assertEqual (2, len (reports))
+      self.assertEqual (2, reports[0]["exported"])
+      self.assertEqual (2, reports[1]["exported"])
+      self.assertEqual (1, reports[1]["removed"])
+      self.assertEqual (0, reports[1]["error"])
+
+      # Nothing was exported until the burst was over.
+      self.assertEqual ([1, 1, 1, 1], polls[:4])
+
+      self.assertTrue ("A new page." in self.readHTML ("sub/New.hylt"))
+      self.assertTrue ("edited" in self.readHTML ("Start.hylt"))
+      self.assertFalse (os.path.exists (hylt.htmlFilename (
+       self.path ("Old.hylt"))))
+
+class PollTest (CollectionTestCase):
+
+   def testReportsChangedAddedAndRemovedPages (self):
+      self.writePage ("Start.hylt", "Start.\n")
+      self.writePage ("a/Page.hylt", "A page.\n")
+      poll_state = {}
+      changed, added, removed = hylt.pollCollection (self.root, poll_state)
+      self.assertEqual ([], changed)
+      self.assertEqual (["Start.hylt", "a/Page.hylt"], sorted (added))
+      self.assertEqual ([], removed)
+
+      # Nothing happened, so nothing is reported.
+      self.assertEqual (([], [], []),
+       hylt.pollCollection (self.root, poll_state))
+
+      self.writePage ("a/Page.hylt", "A page, edited.\n")
+      self.writePage ("a/b/Deep.hylt", "A deep page.\n")
+      self.removePage ("Start.hylt")
+      changed, added, removed = hylt.pollCollection (self.root, poll_state)
+      self.assertEqual (["a/Page.hylt"], changed)
+      self.assertEqual (["a/b/Deep.hylt"], added)
+      self.assertEqual (["Start.hylt"], removed)
+
+   def testWithoutStattingPages (self):
+      self.writePage ("Start.hylt", "Start.\n")
+      poll_state = {}
+      hylt.pollCollection (self.root, poll_state, stat_pages = False)
+
+      # An edit doesn't change the directory, so it goes unnoticed.
+      self.writePage ("Start.hylt", "Start, edited.\n")
+      self.assertEqual (([], [], []),
+       hylt.pollCollection (self.root, poll_state, stat_pages = False))
+
+class WalkTest (CollectionTestCase):
+
+   def setUp (self):
+      CollectionTestCase.setUp (self)
+      for name in ["Start.hylt", "b/Two.hylt", "a/One.hylt", "a/c/Three.hylt",
+       "a/c/Four.hylt"]:
+         self.writePage (name, "A page.\n")
+      self.writePage ("a/notes.txt", "Not a page.\n")
+
+   def walk (self, **options):
+      return list (hylt.walkCollection (self.root, **options))
+
+   def testSortedWalkIsDepthFirst (self):
+      for threads in (1, hylt.WALK_THREADS):
+         self.assertEqual ([
+            ("", ["Start.hylt"], ["a", "b"]),
+            ("a", ["a/One.hylt"], ["a/c"]),
+            ("a/c", ["a/c/Four.hylt", "a/c/Three.hylt"], []),
+            ("b", ["b/Two.hylt"], [])
+         ], self.walk (sort = True, threads = threads))
+
+   def testUnsortedWalkFindsEverything (self):
+      self.assertEqual (["", "a", "a/c", "b"],
+       sorted ([dir_name for dir_name, pages, subdirs in self.walk ()]))
+
+   def testCompressedPagesAreListedByName (self):
+      self.writePage ("a/Packed.hylt.gz", "")
+      self.assertEqual (["a/One.hylt", "a/Packed.hylt"],
+       hylt.listCollectionDir (self.root, "a")[0])
+
+   def testDirectorySymlinksAreNotFollowed (self):
+      if not hasattr (os, "symlink"):
+         return
+      outside = tempfile.mkdtemp (prefix = "hylt-test-outside-")
+      try:
+         open (os.path.join (outside, "Outside.hylt"), "w").close ()
+         os.symlink ("..", self.path ("b/up"))
+         os.symlink (outside, self.path ("out"))
+         os.symlink ("../Start.hylt", self.path ("b/Alias.hylt"))
+         self.assertEqual (["Start.hylt", "a/One.hylt", "a/c/Four.hylt",
+          "a/c/Three.hylt", "b/Alias.hylt", "b/Two.hylt"],
+          sorted (hylt.snapshotCollection (self.root)))
+      finally:
+         shutil.rmtree (outside)
+
+class ExportTest (CollectionTestCase):
+
+   def testUnchangedPagesAreSkippedNextTime (self):
+      self.writePage ("Start.hylt", "The start.\n")
+      for compress in (False, True):
+         hylt.exportCollection (self.root, compress = compress)
+
+         # Saved again, but renders to the same XHTML as before.
+         self.touch ("Start.hylt")
+         stats = hylt.exportCollection (self.root, compress = compress)
+         self.assertEqual ((0, 1), (stats["exported"], stats["unchanged"]))
+         stats = hylt.exportCollection (self.root, compress = compress)
+         self.assertEqual ((0, 1), (stats["unchanged"], stats["skipped"]))
+
+class CacheFileTest (CollectionTestCase):
+
+   def testRoundTrip (self):
+      cache = {"pages": {"Start.hylt": (0, 12.5, u"text")},
+       "retired": set ([1, 2]), "names": ["Start.hylt", None],
+       "flags": frozenset (), "ok": True}
+      hylt.saveCacheFile (self.path ("cache"), cache)
+      self.assertEqual (cache, hylt.loadCacheFile (self.path ("cache")))
+
+   def testAnythingButPlainDataIsRefused (self):
+      for value in [compile ("1", "<cache>", "eval"), [[{"a": Ellipsis}]]]:
+         cache_file = open (self.path ("cache"), "wb")
+         marshal.dump ({"version": hylt.CACHE_VERSION, "value": value},
+          cache_file)
+         cache_file.close ()
+         self.assertEqual (None, hylt.loadCacheFile (self.path ("cache")))
+
+   def testPicklesAndOldVersionsAreRefused (self):
+      cache_file = open (self.path ("cache"), "wb")
+      pickle.dump ({"version": hylt.CACHE_VERSION}, cache_file, 2)
+      cache_file.close ()
+      self.assertEqual (None, hylt.loadCacheFile (self.path ("cache")))
+
+      cache_file = open (self.path ("cache"), "wb")
+      marshal.dump ({"version": hylt.CACHE_VERSION - 1}, cache_file)
+      cache_file.close ()
+      self.assertEqual (None, hylt.loadCacheFile (self.path ("cache")))
+
+class TextIndexTest (CollectionTestCase):
+
+   def setUp (self):
+      CollectionTestCase.setUp (self)
+      self.writePage ("One.hylt", "apple apple apple banana\n")
+      self.writePage ("Two.hylt", "apple banana cherry\n")
+      self.writePage ("Three.hylt", "cherry\n")
+
+   def testRanksByWordFrequency (self):
+      viewer = self.viewer ()
+      self.assertEqual (["One.hylt", "Two.hylt"],
+       hylt.searchPageText (viewer, "apple"))
+      index = viewer.text_index
+      self.assertEqual (["Two.hylt"], hylt.searchTextIndex (index,
+       "Apple CHERRY"))
+      self.assertEqual ([], hylt.searchTextIndex (index, "apple durian"))
+      self.assertEqual ([], hylt.searchTextIndex (index, "a"))
+
+   def testPagesChangedSinceAreIndexed (self):
+      viewer = self.viewer ()
+      self.assertEqual ([], hylt.searchPageText (viewer, "durian"))
+      self.writePage ("Three.hylt", "cherry durian\n")
+      self.removePage ("One.hylt")
+      self.assertEqual (["Three.hylt"], hylt.searchPageText (viewer,
+       "durian"))
+      self.assertEqual (["Two.hylt"], hylt.searchPageText (viewer, "apple"))
+
+   def testStoppedIndexingIsKept (self):
+      calls = []
+      def stopAfterTwoPages ():
+         calls.append (True)
+         return len (calls) > 2
+
+      viewer = self.viewer ()
+      progress = []
+      self.assertEqual ([], hylt.searchPageText (viewer, "apple",
+       stopAfterTwoPages, lambda done, total: progress.append ((done, total))))
+      self.assertEqual (2, len (viewer.text_index["pages"]))
+      self.assertEqual ((2, 3), progress[-1])
+
+      # What was indexed is saved, and the next search carries on.
+      hylt.saveIndexes (viewer)
+      self.assertEqual (2, len (hylt.loadTextIndex (self.root)["pages"]))
+      viewer = self.viewer ()
+      progress = []
+      self.assertEqual (["One.hylt", "Two.hylt"], hylt.searchPageText (
+       viewer, "apple", None, lambda done, total: progress.append (total)))
+      self.assertEqual ([1], sorted (set (progress)))
+
+   def testIndexesAreSavedByTheMainThread (self):
+      viewer = self.viewer ()
+      hylt.startSearch (viewer, "=apple")
+      viewer.search["thread"].join ()
+      cache_name = self.path (os.path.join (hylt.CACHE_DIR, "text-index"))
+      self.assertFalse (os.path.exists (cache_name))
+      hylt.collectSearchResults (viewer)
+      self.assertEqual ("2 matching files found",
+       hylt.describeSearch (viewer.search))
+      hylt.stopSearch (viewer)
+      self.assertTrue (os.path.exists (cache_name))
+
+class FilenameSearchTest (CollectionTestCase):
+
+   def testStopsWithoutAMatch (self):
+      for i in range (20):
+         self.writePage ("d%d/Page.hylt" % (i), "A page.\n")
+      calls = []
+      def shouldStop ():
+         calls.append (True)
+         return len (calls) >= 3
+
+      viewer = self.viewer ()
+      self.assertEqual ([], list (hylt.iterSearchFilenames (viewer,
+       "nothing", shouldStop)))
+      self.assertEqual (3, len (calls))
+
+      # The search picks up where the stopped one left off.
+      self.assertEqual (20, len (list (hylt.iterSearchFilenames (viewer,
+       "Page"))))
+
+class TrigramTest (CollectionTestCase):
+
+   def setUp (self):
+      CollectionTestCase.setUp (self)
+      self.writePage ("Start.hylt", "Nothing here.\n")
+      self.writePage ("Fruit.hylt", "Apples and pears.\n")
+      self.writePage ("Veg.hylt", "Leeks and pears.\n")
+
+   def search (self, viewer, expression):
+      return list (hylt.iterSearchPageRegexp (viewer, expression))
+
+   def testRequiredTrigrams (self):
+      self.assertEqual (set (["foo", "bar"]),
+       hylt.requiredTrigrams ("Foo.*bar"))
+      self.assertEqual (set (["hel", "ell", "llo", "wor", "orl", "rld"]),
+       hylt.requiredTrigrams ("hello(x|y)world"))
+      self.assertEqual (set (["col", "olo"]),
+       hylt.requiredTrigrams ("colou?r"))
+      self.assertEqual (set (["abc"]), hylt.requiredTrigrams ("(abc)+"))
+      self.assertEqual (set (), hylt.requiredTrigrams ("(abc)*|[xyz]+"))
+
+   def testCandidatesAreNarrowedDown (self):
+      viewer = self.viewer ()
+      self.search (viewer, "")
+      index = viewer.trigram_index
+      self.assertEqual (["Fruit.hylt"], hylt.searchTrigramIndex (index,
+       "apple"))
+      self.assertEqual (["Fruit.hylt", "Veg.hylt"],
+       hylt.searchTrigramIndex (index, "pears"))
+      self.assertEqual ([], hylt.searchTrigramIndex (index, "xyzzy"))
+      self.assertEqual (["Fruit.hylt", "Start.hylt", "Veg.hylt"],
+       hylt.searchTrigramIndex (index, "a.b"))
+
+   def testMatchesNamesAndText (self):
+      viewer = self.viewer ()
+      self.assertEqual (["Fruit.hylt"], self.search (viewer, "apples?"))
+      self.assertEqual (["Fruit.hylt"], self.search (viewer, "APPLES"))
+      self.assertEqual (["Veg.hylt"], self.search (viewer,
+       "^veg\\.hylt$"))
+      self.assertEqual (["Fruit.hylt", "Veg.hylt"],
+       self.search (viewer, "p\\Sars"))
+
+   def testPagesChangedSinceAreIndexed (self):
+      viewer = self.viewer ()
+      self.assertEqual ([], self.search (viewer, "zzunique"))
+      self.writePage ("Start.hylt", "Now zzunique.\n")
+      self.removePage ("Veg.hylt")
+      self.assertEqual (["Start.hylt"], self.search (viewer, "zzunique"))
+      self.assertEqual ([], self.search (viewer, "leeks"))
+
+class FindPageTest (CollectionTestCase):
+
+   def rank (self, names, query, visits = {}):
+      """Ranks NAMES for QUERY the way findPage does."""
+
+      table = hylt.buildTitleTable (names)
+      everything = hylt.orderTitleTable (table, visits)
+      order = dict (zip (everything, range (len (everything))))
+      candidates = filter (hylt.fuzzyRegexp (query).match, everything)
+      return [table["pages"][key] for key in
+       hylt.rankTitles (table, order, candidates, query, 10)]
+
+   def testRanksByHowWellTitlesMatch (self):
+      names = ["./A_Pale_Plum_Lemon.hylt", "./apple/Crab.hylt",
+       "./Big_Apple.hylt", "./Pineapple.hylt", "./Apple_Tart.hylt",
+       "./Apple_Pie.hylt", "./Zebra.hylt"]
+      self.assertEqual (["./Apple_Pie.hylt", "./Apple_Tart.hylt",
+       "./Big_Apple.hylt", "./Pineapple.hylt", "./apple/Crab.hylt",
+       "./A_Pale_Plum_Lemon.hylt"], self.rank (names, "apple"))
+
+      # Pages visited more often go first within each group.
+      self.assertEqual (["./Apple_Tart.hylt", "./Apple_Pie.hylt"],
+       self.rank (names, "apple", {"./Apple_Tart.hylt": 2})[:2])
+
+   def testVisitsAreKeptPerUser (self):
+      self.writePage ("Start.hylt", "Start.\n")
+      viewer = self.viewer ()
+      hylt.noteVisit (viewer, "Start.hylt")
+      hylt.saveIndexes (viewer)
+      self.assertFalse (os.path.exists (self.path (".hylt-cache/visits")))
+      self.assertEqual ({"./Start.hylt": 1},
+       hylt.loadVisits (self.viewer ())["counts"])
+
+      os.environ["HOME"] = self.root
+      self.assertEqual ({}, hylt.loadVisits (self.viewer ())["counts"])
+
+class BacklinkTest (CollectionTestCase):
+
+   def setUp (self):
+      CollectionTestCase.setUp (self)
+      self.writePage ("Start.hylt", "See [[Fruit]] and [[sub/Deep]].\n")
+      self.writePage ("Fruit.hylt", "Apples.\n")
+      self.writePage ("sub/Deep.hylt", "Back to [[../Fruit]].\n")
+
+   def testFindsLinksAddedSince (self):
+      viewer = self.viewer ()
+      self.assertEqual (["Start.hylt", "sub/Deep.hylt"],
+       hylt.searchBacklinks (viewer, "Fruit"))
+      self.assertEqual ([], hylt.searchBacklinks (viewer, "Start.hylt"))
+      self.writePage ("Fruit.hylt", "Back to [[Start]].\n")
+      self.removePage ("sub/Deep.hylt")
+      self.assertEqual (["Fruit.hylt"], hylt.searchBacklinks (viewer,
+       "Start.hylt"))
+      self.assertEqual (["Start.hylt"], hylt.searchBacklinks (viewer,
+       "Fruit"))
+
+   def testStoppedIndexingIsKept (self):
+      viewer = self.viewer ()
+      calls = []
+      self.assertEqual ([], hylt.searchBacklinks (viewer, "Fruit",
+       lambda: calls.append (True) or len (calls) > 1))
+      self.assertEqual (1, len (viewer.backlink_index["pages"]))
+      self.assertEqual (["Start.hylt", "sub/Deep.hylt"],
+       hylt.searchBacklinks (viewer, "Fruit"))
+
+class PageSearchTest (CollectionTestCase):
+
+   def testMatchesAsTheQueryChanges (self):
+      self.writePage ("Start.hylt", "Abc abc\nxabcx\n")
+      viewer = self.viewer ()
+      hylt.loadPage (viewer, "Start.hylt")
+      viewer.page_search = {"query": "", "position": None,
+       "data_array": None}
+      self.assertEqual ([], hylt.findPageMatches (viewer))
+
+      for query, matches in [("ab", [(0, 0), (0, 4), (1, 1)]),
+       ("abc", [(0, 0), (0, 4), (1, 1)]), ("abc ", [(0, 0)]),
+       ("abcx", [(1, 1)]), ("ab", [(0, 0), (0, 4), (1, 1)]),
+       ("zz", [])]:
+         viewer.page_search["query"] = query
+         self.assertEqual (matches, hylt.findPageMatches (viewer))
+
+      # A reloaded page is searched all over again.
+      self.writePage ("Start.hylt", "No match\n")
+      hylt.loadPage (viewer, "Start.hylt")
+      viewer.page_search["query"] = "ab"
+      self.assertEqual ([], hylt.findPageMatches (viewer))
+
+class HistoryTest (CollectionTestCase):
+
+   def filenames (self, viewer):
+      history = viewer.history
+      return [history.get (i).filename for i in range (len (history))]
+
+   def testRingDropsTheOldestEntries (self):
+      history = hylt.History (3)
+      for name in "ABCD":
+         history.append (hylt.Location (name, 1, 2, None))
+      self.assertEqual (["B", "C", "D"], [history.get (i).filename
+       for i in range (len (history))])
+      self.assertEqual (None, history.get (0).selected_link)
+
+      history.remove (1)
+      filenames, positions = history.pack ()
+      self.assertEqual (["B", "D"], filenames)
+      unpacked = hylt.History (1)
+      self.assertEqual (0, unpacked.unpack (filenames, positions))
+      self.assertEqual ((1, 2), (unpacked.get (1).cx, unpacked.get (1).cy))
+
+   def testCutAddAndMove (self):
+      viewer = self.viewer ()
+      for name in "ABC":
+         hylt.historyAdd (viewer, name)
+      self.assertEqual (2, hylt.historyMove (viewer, 5))
+      self.assertEqual (-1, hylt.historyMove (viewer, -1))
+      self.assertEqual (0, hylt.historyMove (viewer, 0))
+
+      # Where the viewer was on a page is kept when it moves on.
+      viewer.currentLocation ().cy = 7
+      hylt.historyMove (viewer, -1)
+      self.assertEqual (7, viewer.history.get (1).cy)
+
+      # Following a link from the middle cuts off the forward history.
+      self.assertEqual (1, hylt.historyCut (viewer))
+      hylt.historyAdd (viewer, "D")
+      self.assertEqual (["A", "D"], self.filenames (viewer))
+
+   def testAddingToAFullHistory (self):
+      viewer = self.viewer ()
+      viewer.history = hylt.History (3)
+      for name in "ABC":
+         hylt.historyAdd (viewer, name)
+      viewer.history_position = 2
+      hylt.historyAdd (viewer, "D")
+      self.assertEqual (["B", "C", "D"], self.filenames (viewer))
+      self.assertEqual ("C", viewer.currentLocation ().filename)
+
+      # The page being viewed is never the one dropped.
+      viewer.history_position = 0
+      hylt.historyAdd (viewer, "E")
+      self.assertEqual (["B", "C", "D"], self.filenames (viewer))
+
+class SessionTest (CollectionTestCase):
+
+   def setUp (self):
+      CollectionTestCase.setUp (self)
+      for name in ["Start.hylt", "Gone.hylt", "Other.hylt"]:
+         self.writePage (name, "A page.\n")
+
+   def saveHistory (self, filenames, position):
+      viewer = self.viewer ()
+      for filename in filenames:
+         hylt.historyAdd (viewer, filename)
+      viewer.history_position = position
+      hylt.saveSession (viewer)
+
+   def testSessionsAreKeptPerUser (self):
+      self.saveHistory (["Start.hylt", "Other.hylt"], 1)
+      self.assertTrue (hylt.sessionFilename (self.root).startswith (
+       os.path.join (self.home, "")))
+      self.assertFalse (os.path.exists (self.path (hylt.CACHE_DIR)))
+
+      viewer = self.viewer ()
+      self.assertNotEqual (None, hylt.restoreSession (viewer))
+      self.assertEqual ("Other.hylt", viewer.currentLocation ().filename)
+
+      os.environ["HOME"] = self.root
+      self.assertEqual (None, hylt.restoreSession (self.viewer ()))
+
+   def testMissingHistoryPagesAreDropped (self):
+      self.saveHistory (["Start.hylt", "Gone.hylt", "Other.hylt"], 2)
+      self.removePage ("Gone.hylt")
+
+      # Going back to the missing page goes on to the one before it.
+      runViewer (",q", self.path ("Start.hylt"), True)
+      session = hylt.loadCacheFile (hylt.sessionFilename (self.root))
+      self.assertEqual (["Start.hylt", "Other.hylt"], session["filenames"])
+      self.assertEqual (0, session["history_position"])
+
+class PrefetchTest (CollectionTestCase):
+
+   def setUp (self):
+      CollectionTestCase.setUp (self)
+      self.names = ["P%02d.hylt" % (i) for i in range (20)]
+      for name in self.names:
+         self.writePage (name, "A page.\n")
+
+      # A cache just big enough for four of the pages.
+      page_size = hylt.PageCache ().put ("", 0,
+       hylt.readPage (self.names[0], hylt.PageCache (), self.root))
+      self.page_cache = hylt.PageCache (4 * page_size)
+      self.prefetcher = hylt.Prefetcher (self.page_cache, self.root, 1)
+
+   def tearDown (self):
+      self.prefetcher.stop ()
+      CollectionTestCase.tearDown (self)
+
+   def waitFor (self, count, *stats):
+      deadline = time.time () + 5
+      while (sum ([self.prefetcher.stats[stat] for stat in stats]) < count
+       and time.time () < deadline):
+         time.sleep (0.001)
+
+   def testUnusedPagesDontUseUpTheBudget (self):
+      # One page at a time, as when moving through the links of a page
+      # and going to none of them.
+      for i in range (len (self.names)):
+         self.prefetcher.prefetch ([self.names[i]])
+         self.waitFor (i + 1, "read", "skipped")
+      self.prefetcher.noteLoad (self.names[-1])
+      stats = self.prefetcher.stop ()
+      self.assertEqual ((20, 0, 1, 19), (stats["read"], stats["skipped"],
+       stats["hits"], stats["wasted"]))
+
+   def testOneRequestOnlyFillsHalfTheCache (self):
+      self.prefetcher.prefetch (self.names)
+      self.waitFor (20, "read", "skipped")
+      stats = self.prefetcher.stats
+      self.assertEqual ((3, 17), (stats["read"], stats["skipped"]))
+
+class WorkspaceTest (CollectionTestCase):
+
+   def setUp (self):
+      CollectionTestCase.setUp (self)
+      for name in "abc":
+         self.writePage (name + "/Start.hylt", "Collection %s.\n" % (name))
+
+   def testOnlyExistingCollectionsAreAdded (self):
+      workspace = hylt.Workspace ()
+      self.assertTrue (workspace.add (self.path ("a/Start.hylt")))
+      self.assertFalse (workspace.add (self.path ("d/Start.hylt")))
+      self.assertTrue (workspace.add (self.path ("b/Start.hylt")))
+      self.assertEqual ((self.path ("b/Start.hylt"), None),
+       workspace.following (self.path ("a")))
+      self.assertEqual ((self.path ("a/Start.hylt"), None),
+       workspace.following (self.path ("b")))
+
+   def testVanishedCollectionsAreSkipped (self):
+      runViewer ([lambda: shutil.rmtree (self.path ("b")), "c", "c", "q"],
+       self.path ("a/Start.hylt"), True,
+       [(self.path (name + "/Start.hylt"), True) for name in "bc"])
+      for name, saved in [("a", True), ("b", False), ("c", True)]:
+         self.assertEqual (saved, os.path.exists (hylt.sessionFilename (
+          self.path (name))))
+
+if "__main__" == __name__:
+   unittest.main ()